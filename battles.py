@@ -0,0 +1,135 @@
+from typing import List, NamedTuple, Optional, Tuple
+import calendar
+import json
+import zlib
+
+from bs_api import normalize_tag
+
+# msgspec decodes battle logs straight into typed objects with only the fields we need, json is used without it
+try:
+    import msgspec
+except ImportError:
+    msgspec = None
+
+# types of battles the bot is looking for
+SCRIM_TYPES: tuple = ("friendly", "tournament")
+
+
+# one 3v3 friendly or tournament battle from battle log with only the fields the bot uses
+# time is a timestamp (seconds since epoch, UTC)
+class Battle(NamedTuple):
+    time: int
+    fingerprint: int
+    type: str
+    mode: str
+    map: str
+    result: str
+    players: Tuple[str, ...]
+    brawlers: Tuple[str, ...]
+
+
+# time of the battle from battle log (20230329T123456.000Z) as a timestamp, battle times are in UTC
+def battle_timestamp(date: str) -> int:
+    return calendar.timegm((int(date[0:4]), int(date[4:6]), int(date[6:8]),
+                            int(date[9:11]), int(date[11:13]), int(date[13:15]), 0, 0, 0))
+
+
+# fingerprint of a battle, so two battles with the same battle time can be told apart
+def battle_fingerprint(time: int, mode: str, bsmap: str, result: str, players: Tuple[str, ...], brawlers: Tuple[str, ...]) -> int:
+    return zlib.crc32("\n".join((str(time), mode, bsmap, result) + players + brawlers).encode())
+
+
+def create_battle(date: str, bstype: str, mode: str, bsmap: str, result: str, players: Tuple[str, ...], brawlers: Tuple[str, ...]) -> Battle:
+    time: int = battle_timestamp(date)
+    return Battle(time, battle_fingerprint(time, mode, bsmap, result, players, brawlers), bstype, mode, bsmap,
+                  result, players, brawlers)
+
+
+if msgspec != None:
+    # schema of battle log, everything else in the payload is skipped while decoding
+    class BrawlerSchema(msgspec.Struct, frozen=True):
+        name: str = ""
+
+    class PlayerSchema(msgspec.Struct, frozen=True):
+        tag: str = ""
+        name: str = ""
+        brawler: Optional[BrawlerSchema] = None
+
+    class BattleInfoSchema(msgspec.Struct, frozen=True):
+        mode: str = ""
+        type: Optional[str] = None
+        result: str = ""
+        teams: Optional[Tuple[Tuple[PlayerSchema, ...], ...]] = None
+        players: Optional[Tuple[PlayerSchema, ...]] = None
+
+    class EventSchema(msgspec.Struct, frozen=True):
+        map: Optional[str] = None
+
+    class BattleSchema(msgspec.Struct, frozen=True, rename={"battle_time": "battleTime"}):
+        battle_time: str
+        event: EventSchema = EventSchema()
+        battle: BattleInfoSchema = BattleInfoSchema()
+
+    class BattleLogSchema(msgspec.Struct, frozen=True):
+        items: Tuple[BattleSchema, ...] = ()
+
+    BATTLE_LOG_DECODER = msgspec.json.Decoder(BattleLogSchema)
+
+
+# name of the player from their own battle log (None if it isn´t there) and 3v3 friendly and tournament battles, newest first
+# raises ValueError when the battle log can´t be decoded
+def decode_battle_log(tag: str, raw: bytes) -> Tuple[str, List[Battle]]:
+    if msgspec == None:
+        data = json.loads(raw)
+        if type(data) != dict:
+            raise ValueError("battle log isn´t an object")
+        try:
+            return normalize_battle_log(tag, data)
+        except (KeyError, TypeError, AttributeError) as error:
+            raise ValueError(f"unexpected battle log: {error!r}")
+    try:
+        log = BATTLE_LOG_DECODER.decode(raw)
+    except msgspec.DecodeError as error:
+        raise ValueError(str(error))
+    full_tag: str = "#" + normalize_tag(tag)
+    name: str = None
+    battles: List[Battle] = []
+    for item in log.items:
+        info = item.battle
+        teams = info.teams
+        if name == None:
+            for player in (info.players or ()) + tuple(player for team in (teams or ()) for player in team):
+                if player.tag == full_tag:
+                    name = player.name
+        if info.type in SCRIM_TYPES and teams != None and len(teams) == 2 and len(teams[0]) == 3 and len(teams[1]) == 3:
+            players = tuple(player.name for team in teams for player in team)
+            brawlers = tuple(
+                player.brawler.name if player.brawler != None else "" for team in teams for player in team)
+            battles.append(create_battle(item.battle_time, info.type, info.mode,
+                                         item.event.map or "", info.result, players, brawlers))
+    return name, battles
+
+
+# same as decode_battle_log() for battle log already decoded from json
+def normalize_battle_log(tag: str, data: dict) -> Tuple[str, List[Battle]]:
+    full_tag: str = "#" + normalize_tag(tag)
+    name: str = None
+    battles: List[Battle] = []
+    for battle in data.get("items", []):
+        info: dict = battle.get("battle", {})
+        teams = info.get("teams")
+        if type(teams) != list:
+            teams = None
+        if name == None:
+            for player in info.get("players", []) + [player for team in (teams or []) for player in team]:
+                if player.get("tag") == full_tag and "name" in player:
+                    name = str(player["name"])
+        if info.get("type") in SCRIM_TYPES and teams != None and len(teams) == 2 and len(teams[0]) == 3 and len(teams[1]) == 3:
+            # missing names are empty like in decode_battle_log()
+            players = tuple(player.get("name", "")
+                            for team in teams for player in team)
+            brawlers = tuple((player.get("brawler") or {}).get("name", "")
+                             for team in teams for player in team)
+            battles.append(create_battle(battle["battleTime"], info["type"], info.get("mode", ""),
+                                         (battle.get("event") or {}).get("map") or "", info.get("result", ""), players, brawlers))
+    return name, battles
@@ -0,0 +1,405 @@
+from typing import Dict, List, Tuple
+import argparse
+import asyncio
+import collections
+import datetime
+import json
+import multiprocessing
+import os
+import random
+import tempfile
+import time
+import tracemalloc
+
+# benchmark of scan cycles without Brawl Stars API and Discord
+# a local stand-in of the API runs in its own process (so serving requests isn´t measured) and plays synthetic scrims,
+# the bot scans it with fake Discord channels which only record what would be sent
+#   python bench.py --players 1000 --guilds 50 --cycles 5 --latency 50 --throttle 0.01
+
+# characters of player tags
+TAG_CHARACTERS: str = "0289PYLQGRJCUV"
+BRAWLERS: tuple = ("SHELLY", "COLT", "BULL", "BROCK", "RICO", "SPIKE", "BARLEY", "JESSIE", "NITA", "DYNAMIKE",
+                   "EL PRIMO", "MORTIS", "CROW", "POCO", "BO", "PIPER", "PAM", "TARA", "DARRYL", "PENNY",
+                   "FRANK", "GENE", "TICK", "LEON", "ROSA", "CARL", "BIBI", "8-BIT", "SANDY", "BEA")
+# modes of battle log the stand-in plays scrims in
+BATTLE_LOG_MODES: tuple = ("gemGrab", "brawlBall", "bounty",
+                           "heist", "knockout", "hotZone")
+# battle log of the API has at most 25 battles
+BATTLE_LOG_SIZE: int = 25
+
+
+def player_tag(number: int) -> str:
+    tag: str = ""
+    number += len(TAG_CHARACTERS) ** 5
+    while number > 0:
+        number, digit = divmod(number, len(TAG_CHARACTERS))
+        tag = TAG_CHARACTERS[digit] + tag
+    return tag
+
+
+# battles of one cycle are at least this many seconds after the battles of the previous cycle
+GAME_SECONDS: int = 120
+
+
+def battle_time(timestamp: float) -> str:
+    return datetime.datetime.fromtimestamp(timestamp, datetime.timezone.utc).strftime("%Y%m%dT%H%M%S.000Z")
+
+
+# synthetic players and scrim lobbies, players of a lobby play best of 3 against each other
+class World:
+    def __init__(self, players: int, guilds: int, overlap: float, seed: int) -> None:
+        rng = random.Random(seed)
+        self.players: List[Tuple[str, str]] = [
+            (player_tag(i), f"Player{i}") for i in range(players)]
+        # every player is tracked by one server and by overlap of them by one more
+        self.guilds: Dict[int, List[str]] = {
+            guild_id: [] for guild_id in range(1, guilds + 1)}
+        for tag, name in self.players:
+            guild_ids: List[int] = [rng.randint(1, guilds)]
+            if guilds > 1 and rng.random() < overlap:
+                guild_ids.append(rng.choice(
+                    [guild_id for guild_id in self.guilds if guild_id != guild_ids[0]]))
+            for guild_id in guild_ids:
+                self.guilds[guild_id].append(tag)
+        # lobbies of 6 players, the last players without a full lobby don´t play scrims
+        shuffled: List[Tuple[str, str]] = list(self.players)
+        rng.shuffle(shuffled)
+        self.lobbies: List[List[Tuple[str, str]]] = [
+            shuffled[i:i + 6] for i in range(0, len(shuffled) - 5, 6)]
+
+
+# stand-in of Brawl Stars API, battle logs change only when a new cycle is played
+class StandInAPI:
+    def __init__(self, world: World, maps: Dict[str, tuple], scrim_rate: float, latency: float, throttle: float, retry_after: float, max_age: int, seed: int) -> None:
+        self.__rng = random.Random(seed)
+        self.__maps = maps
+        self.__scrim_rate = scrim_rate
+        self.__latency = latency
+        self.__throttle = throttle
+        self.__retry_after = retry_after
+        self.__max_age = max_age
+        self.__lobbies = world.lobbies
+        self.__names: Dict[str, str] = dict(world.players)
+        self.__logs: Dict[str, collections.deque] = {
+            tag: collections.deque(maxlen=BATTLE_LOG_SIZE) for tag in self.__names}
+        # battle logs are encoded once per cycle, serving them costs nearly nothing
+        self.__encoded: Dict[str, bytes] = {}
+        # lobby -> (mode, map, wins of the first team, wins of the second team, brawlers) of the series being played
+        self.__series: Dict[int, list] = {}
+        # time of the last played cycle, cycles can be faster than games, so battle times don´t repeat
+        self.__clock: float = 0
+        # (endpoint, status) -> number of requests
+        self.requests: collections.Counter = collections.Counter()
+        self.__encode()
+
+    def __encode(self) -> None:
+        for tag, log in self.__logs.items():
+            self.__encoded[tag] = json.dumps(
+                {"items": list(log), "paging": {"cursors": {}}}).encode()
+
+    # every lobby plays one game with scrim_rate, every player also plays a game the bot ignores
+    def play_cycle(self) -> dict:
+        self.__clock = max(time.time(), self.__clock + GAME_SECONDS)
+        now: float = self.__clock
+        games: int = 0
+        finished: int = 0
+        for number, lobby in enumerate(self.__lobbies):
+            if self.__rng.random() >= self.__scrim_rate:
+                continue
+            if number not in self.__series:
+                mode: str = self.__rng.choice(BATTLE_LOG_MODES)
+                self.__series[number] = [mode, self.__rng.choice(self.__maps[mode]), 0, 0,
+                                         self.__rng.sample(BRAWLERS, 6)]
+            series: list = self.__series[number]
+            first_won: bool = self.__rng.random() < 0.5
+            series[2 if first_won else 3] += 1
+            games += 1
+            for i, (tag, name) in enumerate(lobby):
+                own, enemy = (lobby[:3], lobby[3:]) if i < 3 else (
+                    lobby[3:], lobby[:3])
+                won: bool = first_won == (i < 3)
+                brawlers: List[str] = series[4] if i < 3 else series[4][3:] + series[4][:3]
+                self.__logs[tag].appendleft({
+                    "battleTime": battle_time(now), "event": {"id": 15000000 + number, "mode": series[0], "map": series[1]},
+                    "battle": {"mode": series[0], "type": "friendly", "result": "victory" if won else "defeat", "duration": 120,
+                               "teams": [[{"tag": "#" + player[0], "name": player[1], "brawler": {"id": 16000000, "name": brawler, "power": 11, "trophies": 750}}
+                                          for player, brawler in zip(team, team_brawlers)]
+                                         for team, team_brawlers in ((own, brawlers[:3]), (enemy, brawlers[3:]))]}})
+            if max(series[2], series[3]) == 2:
+                del self.__series[number]
+                finished += 1
+        for tag, name in self.__names.items():
+            if self.__rng.random() < 0.5:
+                self.__logs[tag].appendleft({
+                    "battleTime": battle_time(now - 60), "event": {"id": 15000001, "mode": "soloShowdown", "map": "Skull Creek"},
+                    "battle": {"mode": "soloShowdown", "type": "ranked", "rank": 4, "duration": 100, "trophyChange": 2,
+                               "players": [{"tag": "#" + tag, "name": name, "brawler": {"id": 16000000, "name": "SHELLY", "power": 11, "trophies": 750}}]}})
+        self.__encode()
+        return {"games": games, "finished": finished}
+
+    async def __respond(self, endpoint: str, tag: str, body):
+        from aiohttp import web
+        if self.__latency > 0:
+            await asyncio.sleep(self.__latency)
+        tag = tag.lstrip("#").upper()
+        if self.__throttle > 0 and self.__rng.random() < self.__throttle:
+            self.requests[(endpoint, 429)] += 1
+            return web.json_response({"reason": "requestThrottled"}, status=429, headers={"Retry-After": str(self.__retry_after)})
+        if tag not in self.__names:
+            self.requests[(endpoint, 404)] += 1
+            return web.json_response({"reason": "notFound"}, status=404)
+        self.requests[(endpoint, 200)] += 1
+        return web.Response(body=body(tag), content_type="application/json",
+                            headers={"Cache-Control": f"max-age={self.__max_age}"} if self.__max_age > 0 else None)
+
+    async def player(self, request):
+        return await self.__respond("player", request.match_info["tag"],
+                                    lambda tag: json.dumps({"tag": "#" + tag, "name": self.__names[tag]}).encode())
+
+    async def battle_log(self, request):
+        return await self.__respond("battlelog", request.match_info["tag"], lambda tag: self.__encoded[tag])
+
+    async def cycle(self, request):
+        from aiohttp import web
+        return web.json_response(self.play_cycle())
+
+    async def stats(self, request):
+        from aiohttp import web
+        return web.json_response([[endpoint, status, count] for (endpoint, status), count in self.requests.items()])
+
+    def app(self):
+        from aiohttp import web
+        app = web.Application()
+        app.router.add_get("/v1/players/{tag}/battlelog", self.battle_log)
+        app.router.add_get("/v1/players/{tag}", self.player)
+        app.router.add_post("/bench/cycle", self.cycle)
+        app.router.add_get("/bench/stats", self.stats)
+        return app
+
+
+# runs in its own process, sends its port back when it is listening
+def serve(world: World, maps: Dict[str, tuple], options: dict, port: int, ready) -> None:
+    from aiohttp import web
+
+    async def run() -> None:
+        runner = web.AppRunner(StandInAPI(world, maps, **options).app())
+        await runner.setup()
+        site = web.TCPSite(runner, "127.0.0.1", port)
+        await site.start()
+        ready.put(runner.addresses[0][1])
+        await asyncio.Event().wait()
+
+    asyncio.run(run())
+
+
+# Discord objects the scan needs, channels remember what would be sent
+class FakeMessage:
+    def __init__(self, message_id: int) -> None:
+        self.id = message_id
+
+    async def add_reaction(self, emoji: str) -> None:
+        pass
+
+
+class FakeChannel:
+    def __init__(self, guild, channel_id: int) -> None:
+        self.guild = guild
+        self.id = channel_id
+        self.sent: List = []
+        self.messages: int = 0
+
+    async def send(self, content: str = None, embed=None, embeds=None) -> FakeMessage:
+        self.messages += 1
+        if embeds != None:
+            self.sent.extend(embeds)
+        else:
+            self.sent.append(embed if embed != None else content)
+        return FakeMessage(self.messages + self.id * 1000000)
+
+
+class FakeGuild:
+    def __init__(self, guild_id: int) -> None:
+        self.id = guild_id
+        self.channel = FakeChannel(self, guild_id * 10)
+
+    def get_channel(self, channel_id: int):
+        return self.channel if channel_id == self.channel.id else None
+
+
+# measures how long the event loop was blocked, every sleep taking longer than planned is a block
+class LoopMonitor:
+    def __init__(self, interval: float = 0.005) -> None:
+        self.interval = interval
+        self.blocked: float = 0
+        self.longest: float = 0
+        self.__task: asyncio.Task = None
+
+    def reset(self) -> None:
+        self.blocked = 0
+        self.longest = 0
+
+    async def __run(self) -> None:
+        while True:
+            start: float = time.perf_counter()
+            await asyncio.sleep(self.interval)
+            lag: float = time.perf_counter() - start - self.interval
+            if lag > self.interval:
+                self.blocked += lag
+                self.longest = max(self.longest, lag)
+
+    def start(self) -> None:
+        self.__task = asyncio.create_task(self.__run())
+
+    def stop(self) -> None:
+        self.__task.cancel()
+
+
+# requests the stand-in got, with workers not all of them go through the scheduler of the bot
+async def stand_in_requests(session, port: int) -> Tuple[int, int]:
+    async with session.get(f"http://127.0.0.1:{port}/bench/stats") as response:
+        counts: List = await response.json()
+    return sum(count for endpoint, status, count in counts), sum(count for endpoint, status, count in counts if status == 429)
+
+
+# returns (embeds, messages) sent to all channels
+def sent_embeds(guilds: Dict[int, FakeGuild]) -> Tuple[int, int]:
+    return sum(len(guild.channel.sent) for guild in guilds.values()), sum(guild.channel.messages for guild in guilds.values())
+
+
+async def run_benchmark(scrim_bot, world: World, port: int, args) -> None:
+    import aiohttp
+    guilds: Dict[int, FakeGuild] = {
+        guild_id: FakeGuild(guild_id) for guild_id in world.guilds}
+    scrim_bot.bot.get_guild = guilds.get
+    await scrim_bot.bot.setup_hook()
+    monitor = LoopMonitor()
+    monitor.start()
+    memory: bool = not args.no_tracemalloc
+    if memory:
+        tracemalloc.start()
+    print(f"{len(world.players)} players, {len(world.guilds)} servers, {len(world.lobbies)} lobbies, "
+          f"fetch workers {scrim_bot.FETCH_WORKERS}")
+    print(f"{'cycle':>5} {'games':>6} {'series':>6} {'posted':>6} {'msgs':>5} {'requests':>8} {'429':>5} {'wall s':>8} {'blocked s':>9} {'longest ms':>10} {'peak MiB':>8} {'flush s':>7}")
+    async with aiohttp.ClientSession() as session:
+        for cycle in range(1, args.cycles + 1):
+            async with session.post(f"http://127.0.0.1:{port}/bench/cycle") as response:
+                played: dict = await response.json()
+            subscribers: dict = scrim_bot.get_subscribers()
+            requests, throttled = await stand_in_requests(session, port)
+            posted, messages = sent_embeds(guilds)
+            monitor.reset()
+            if memory:
+                tracemalloc.reset_peak()
+            start: float = time.perf_counter()
+            await scrim_bot.scan_players(list(subscribers), subscribers)
+            wall: float = time.perf_counter() - start
+            peak: float = tracemalloc.get_traced_memory()[1] / 2 ** 20 if memory else 0
+            requests_now, throttled_now = await stand_in_requests(session, port)
+            # finished matches are sent by the outbox after the scan
+            await scrim_bot.OUTBOX.drain()
+            posted_now, messages_now = sent_embeds(guilds)
+            start = time.perf_counter()
+            await scrim_bot.flush_all(scrim_bot.STORES)
+            flush: float = time.perf_counter() - start
+            print(f"{cycle:>5} {played['games']:>6} {played['finished']:>6} {posted_now - posted:>6} {messages_now - messages:>5} "
+                  f"{requests_now - requests:>8} {throttled_now - throttled:>5} {wall:>8.3f} "
+                  f"{monitor.blocked:>9.3f} {monitor.longest * 1000:>10.1f} {peak:>8.1f} {flush:>7.3f}")
+        # statistics of every game mode of every server, from rolling statistics (twice, the second time from rendered embeds)
+        # and from the database for windows longer than the rolling statistics
+        for label, days in (("get_stats 7 days", None), ("get_stats 7 days cached", None), ("get_stats 30 days", 30),
+                            ("get_stats 60 days", 60)):
+            monitor.reset()
+            start = time.perf_counter()
+            for guild in guilds.values():
+                for mode in scrim_bot.STATS_MODES:
+                    await scrim_bot.get_stats(guild.channel, mode, days)
+            wall = time.perf_counter() - start
+            print(f"{label}: {wall:.3f} s for {len(guilds) * len(scrim_bot.STATS_MODES)} messages, "
+                  f"blocked {monitor.blocked:.3f} s, longest {monitor.longest * 1000:.1f} ms")
+        async with session.get(f"http://127.0.0.1:{port}/bench/stats") as response:
+            print("stand-in requests:", ", ".join(
+                f"{endpoint} {status}: {count}" for endpoint, status, count in sorted(await response.json())))
+    print(f"scheduler: {scrim_bot.API.stats()}, open matches: {len(scrim_bot.POWER_MATCHES)}")
+    if memory:
+        tracemalloc.stop()
+    monitor.stop()
+    scrim_bot.LOOP_LAG_WATCHER.cancel()
+    await scrim_bot.API.close()
+    if scrim_bot.FETCHERS != None:
+        await scrim_bot.FETCHERS.close()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="Benchmark of scan cycles against a local stand-in of Brawl Stars API")
+    parser.add_argument("--players", type=int, default=600)
+    parser.add_argument("--guilds", type=int, default=20)
+    parser.add_argument("--overlap", type=float, default=0.2,
+                        help="part of players tracked by two servers")
+    parser.add_argument("--scrim-rate", type=float, default=0.5,
+                        help="chance of a lobby playing a scrim game in a cycle")
+    parser.add_argument("--latency", type=float, default=50,
+                        help="latency of the stand-in in milliseconds")
+    parser.add_argument("--throttle", type=float, default=0,
+                        help="part of requests answered with 429")
+    parser.add_argument("--retry-after", type=float, default=1,
+                        help="Retry-After of 429 responses in seconds")
+    parser.add_argument("--max-age", type=int, default=0,
+                        help="max-age of Cache-Control of the stand-in responses")
+    parser.add_argument("--cycles", type=int, default=5)
+    parser.add_argument("--rate", type=float, default=1000,
+                        help="requests per second of the scheduler")
+    parser.add_argument("--workers", type=int, default=0,
+                        help="fetch worker processes (FETCH_WORKERS)")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--serve", type=int, default=None, metavar="PORT",
+                        help="only run the stand-in on the port (POST /bench/cycle plays a cycle)")
+    parser.add_argument("--no-tracemalloc", action="store_true",
+                        help="don´t measure peak memory (tracemalloc slows everything down)")
+    args = parser.parse_args()
+
+    world = World(args.players, args.guilds, args.overlap, args.seed)
+    # maps the bot counts statistics of, same as in bot.py
+    maps: Dict[str, tuple] = {
+        "gemGrab": ("Hard Rock Mine", "Gem Fort", "Crystal Arcade"),
+        "brawlBall": ("Backyard Bowl", "Pinhole Punt", "Field Goal"),
+        "bounty": ("Shooting Star", "Dry Season", "Layer Cake"),
+        "heist": ("Hot Potato", "Safe Zone"),
+        "knockout": ("Goldarm Gulch", "Out in the Open", "Flaring Phoenix"),
+        "hotZone": ("Ring of Fire", "Parallel Plays", "Split")}
+    options: dict = {"scrim_rate": args.scrim_rate, "latency": args.latency / 1000, "throttle": args.throttle,
+                     "retry_after": args.retry_after, "max_age": args.max_age, "seed": args.seed}
+    context = multiprocessing.get_context("spawn")
+    ready = context.Queue()
+    if args.serve != None:
+        print(f"Stand-in of Brawl Stars API on http://127.0.0.1:{args.serve}/v1")
+        serve(world, maps, options, args.serve, ready)
+        return
+    server = context.Process(target=serve, args=(
+        world, maps, options, 0, ready), daemon=True)
+    server.start()
+    port: int = ready.get(timeout=30)
+
+    # the bot works with files in the current directory, so it runs in an empty one with the synthetic servers
+    directory = tempfile.TemporaryDirectory()
+    os.chdir(directory.name)
+    names: Dict[str, str] = dict(world.players)
+    with open("servers.json", "w") as jsonfile:
+        json.dump({str(guild_id): {"room": guild_id * 10, "players": {tag: names[tag] for tag in tags}}
+                   for guild_id, tags in world.guilds.items()}, jsonfile)
+    os.environ.update({"BS_API": f"http://127.0.0.1:{port}/v1", "BS_API_TOKEN": "Bearer bench",
+                       "BS_API_RATE": str(args.rate), "BS_API_BURST": str(int(args.rate)),
+                       "FETCH_WORKERS": str(args.workers), "MATCHES_DB": "matches.db", "METRICS_PORT": "0",
+                       "OUTBOX_DELAY_SECONDS": "0", "OUTBOX_INTERVAL_SECONDS": "0"})
+    import bot as scrim_bot
+    try:
+        asyncio.run(run_benchmark(scrim_bot, world, port, args))
+    finally:
+        server.terminate()
+        scrim_bot.MATCHES.close()
+        os.chdir("/")
+        directory.cleanup()
+
+
+if __name__ == "__main__":
+    main()
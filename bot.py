@@ -1,42 +1,217 @@
 from os import getenv
+from time import perf_counter
 
-from discord import Intents, Embed, Activity, ActivityType, Message
+from discord import Intents, Embed, Activity, ActivityType, Message, Object, File
 from discord.ext import commands, tasks
 from discord.ext.commands import Context
 from dotenv import load_dotenv
-from typing import List
+from typing import Dict, List, Tuple
 import datetime
-import json
+import hashlib
+import sys
+import io
 import collections
-import aiohttp
+import asyncio
+
+from battles import Battle, decode_battle_log
+from bs_api import RequestScheduler, ResponseCache, PlayerNameCache, normalize_tag, INTERACTIVE, BACKGROUND
+from brawler_stats import GuildStats, GuildLeaderboards, RollingStats
+from outbox import Outbox
+from metrics import Registry, Counter, Gauge, Histogram, watch_loop_lag, start_metrics_server
+from polling import PollWheel
+from profiling import ProfileCapture, CycleProfiler, StackSampler
+from storage import JsonStore, GuildStore, MatchStore, BattleLogArchive, FingerprintStore, load_json, flush_all, LEGACY_STATS_IMPORTED
+from workers import FetcherPool
 
 # opens env file with tokens
 load_dotenv("dis.env")
 TOKEN = getenv("DISCORD_TOKEN")
 BS_TOKEN = getenv("BS_API_TOKEN")
 
-BS_API = "https://api.brawlstars.com/v1"
+# address of Brawl Stars API, can point to a local stand-in (bench.py)
+BS_API: str = getenv("BS_API", "https://api.brawlstars.com/v1")
+# maximum number of requests to Brawl Stars API running at the same time
+MAX_CONCURRENT_REQUESTS: int = int(getenv("MAX_CONCURRENT_REQUESTS", "20"))
+# quota of our API key, requests per second and how many can be sent in a burst
+BS_API_RATE: float = float(getenv("BS_API_RATE", "10"))
+BS_API_BURST: int = int(getenv("BS_API_BURST", "10"))
+# how many responses of the API (and how many bytes of them) are cached, each for max-age the API sends
+API_CACHE_ENTRIES: int = int(getenv("API_CACHE_ENTRIES", "2000"))
+API_CACHE_BYTES: int = int(getenv("API_CACHE_BYTES", "33554432"))
+# how long (in seconds) we remember names of players and tags which don´t exist
+PLAYER_NAME_TTL: float = float(getenv("PLAYER_NAME_TTL", "21600"))
+INVALID_TAG_TTL: float = float(getenv("INVALID_TAG_TTL", "3600"))
+# number of processes fetching and decoding battle logs, 0 = the bot fetches them itself
+FETCH_WORKERS: int = int(getenv("FETCH_WORKERS", "0"))
+# with fetch workers the bot keeps MAIN_API_SHARE of the quota for its own requests (names of players, commands)
+# and the workers share the rest, so all processes together stay within the quota
+MAIN_API_SHARE: float = float(getenv("MAIN_API_SHARE", "0.1")) if FETCH_WORKERS > 0 else 1
+MAIN_API_RATE: float = BS_API_RATE * MAIN_API_SHARE
+MAIN_API_BURST: int = max(1, int(BS_API_BURST * MAIN_API_SHARE))
+# how long (seconds) the bot waits for a battle log from the fetch workers
+FETCH_TIMEOUT_SECONDS: float = float(getenv("FETCH_TIMEOUT_SECONDS", "300"))
+# how many fetched battle logs can wait for detection, fetching waits while the queue is full
+SCAN_QUEUE_SIZE: int = int(getenv("SCAN_QUEUE_SIZE", "50"))
+# how often are battle logs of players scanned
+SCAN_INTERVAL_MINUTES: float = float(getenv("SCAN_INTERVAL_MINUTES", "10"))
+# polls are spread over the interval, one slot every POLL_TICK_SECONDS
+POLL_TICK_SECONDS: float = float(getenv("POLL_TICK_SECONDS", "5"))
+# players in a Power Match are polled every ACTIVE_POLL_SECONDS, players without a game for IDLE_AFTER_DAYS every IDLE_POLL_SECONDS
+ACTIVE_POLL_SECONDS: float = float(getenv("ACTIVE_POLL_SECONDS", "120"))
+IDLE_POLL_SECONDS: float = float(getenv("IDLE_POLL_SECONDS", "3600"))
+IDLE_AFTER_DAYS: float = float(getenv("IDLE_AFTER_DAYS", "3"))
+# a Power Match without a new game for OPEN_MATCH_SECONDS isn´t played anymore and is forgotten
+OPEN_MATCH_SECONDS: float = float(getenv("OPEN_MATCH_SECONDS", "1800"))
+# random part of every interval, 0.1 = +-10 %
+POLL_JITTER: float = float(getenv("POLL_JITTER", "0.1"))
+# how often are changed json files written to disk
+FLUSH_INTERVAL_SECONDS: float = float(getenv("FLUSH_INTERVAL_SECONDS", "30"))
+# directories with one json file per server for servers and their players and for settings of statistics,
+# at most GUILD_CACHE_SIZE servers of each are kept in memory
+SERVERS_DIR: str = getenv("SERVERS_DIR", "servers")
+STATS_DIR: str = getenv("STATS_DIR", "stats")
+GUILD_CACHE_SIZE: int = int(getenv("GUILD_CACHE_SIZE", "1000"))
+# database of finished matches
+MATCHES_DB: str = getenv("MATCHES_DB", "matches.db")
+# how long (seconds) games of sent matches are remembered and how many of them at most
+REPORTED_MATCHES_TTL: float = float(getenv("REPORTED_MATCHES_TTL", "172800"))
+REPORTED_MATCHES_MAX: int = int(getenv("REPORTED_MATCHES_MAX", "50000"))
+# how many statistics messages (and characters of their embeds) we keep in memory and for how long (seconds)
+STATS_CACHE_MESSAGES: int = int(getenv("STATS_CACHE_MESSAGES", "500"))
+STATS_CACHE_CHARS: int = int(getenv("STATS_CACHE_CHARS", "2000000"))
+STATS_CACHE_TTL: float = float(getenv("STATS_CACHE_TTL", "604800"))
+# statistics are counted in time buckets of STATS_BUCKET_SECONDS (a day), the last STATS_BUCKETS of them are kept in memory
+# and statistics without a number of days are from the last STATS_DAYS days
+STATS_BUCKET_SECONDS: int = int(getenv("STATS_BUCKET_SECONDS", "86400"))
+STATS_BUCKETS: int = int(getenv("STATS_BUCKETS", "35"))
+STATS_DAYS: int = int(getenv("STATS_DAYS", "7"))
+# finished matches of one channel are collected for OUTBOX_DELAY_SECONDS and sent together, messages of one channel
+# are at least OUTBOX_INTERVAL_SECONDS apart
+OUTBOX_DELAY_SECONDS: float = float(getenv("OUTBOX_DELAY_SECONDS", "2"))
+OUTBOX_INTERVAL_SECONDS: float = float(getenv("OUTBOX_INTERVAL_SECONDS", "1"))
+# directory where every fetched battle log is archived for replay.py, empty = battle logs aren´t archived
+BATTLE_LOG_ARCHIVE: str = getenv("BATTLE_LOG_ARCHIVE", "")
+# local http endpoint with metrics in Prometheus format, port 0 turns it off
+METRICS_HOST: str = getenv("METRICS_HOST", "127.0.0.1")
+METRICS_PORT: int = int(getenv("METRICS_PORT", "9464"))
+# the event loop thread is sampled every PROFILE_SAMPLE_SECONDS seconds for d!profile sample, 0 turns it off
+PROFILE_SAMPLE_SECONDS: float = float(getenv("PROFILE_SAMPLE_SECONDS", "0"))
+# d!profile [cycles] gives up when the cycles weren´t profiled in PROFILE_TIMEOUT_SECONDS seconds
+PROFILE_TIMEOUT_SECONDS: float = float(getenv("PROFILE_TIMEOUT_SECONDS", "900"))
+
+# metrics of the bot, shown on the metrics endpoint and by d!perf
+METRICS = Registry()
+SCAN_SECONDS: Histogram = METRICS.add(Histogram(
+    "scrimbot_scan_cycle_seconds", "Duration of scan cycles with at least one player to poll"))
+SCANNED_PLAYERS: Counter = METRICS.add(Counter(
+    "scrimbot_scanned_players_total", "Battle logs polled by scan cycles"))
+API_SECONDS: Histogram = METRICS.add(Histogram(
+    "scrimbot_api_request_seconds", "Latency of requests to Brawl Stars API", ("endpoint", "status")))
+MATCHES_FINISHED: Counter = METRICS.add(Counter(
+    "scrimbot_matches_finished_total", "Power Matches which were finished and sent"))
+FLUSH_SECONDS: Histogram = METRICS.add(Histogram(
+    "scrimbot_flush_seconds", "Duration of writing changed files and the database"))
+LOOP_LAG_SECONDS: Histogram = METRICS.add(Histogram(
+    "scrimbot_event_loop_lag_seconds", "How late the event loop woke up from a one second sleep"))
+METRICS.add(Gauge("scrimbot_open_matches",
+            "Power Matches which aren´t finished yet", lambda: len(POWER_MATCHES)))
+METRICS.add(Gauge("scrimbot_reported_games",
+            "Fingerprints of games of sent matches", lambda: len(REPORTED_MATCHES)))
+METRICS.add(Gauge("scrimbot_polled_players",
+            "Players planned in the poll wheel", lambda: len(POLL_WHEEL)))
+METRICS.add(Gauge("scrimbot_outbox_embeds",
+            "Embeds of finished matches waiting to be sent", lambda: len(OUTBOX)))
+METRICS.add(Gauge("scrimbot_api_queue_depth",
+            "Requests waiting for a token of the API scheduler", lambda: API.queue_depth))
+
+# every request to Brawl Stars API goes through this scheduler
+API = RequestScheduler(BS_API, BS_TOKEN, MAIN_API_RATE,
+                       MAIN_API_BURST, MAX_CONCURRENT_REQUESTS, latency=API_SECONDS,
+                       cache=ResponseCache(API_CACHE_ENTRIES, API_CACHE_BYTES))
+# processes fetching battle logs, None when battle logs are fetched by the bot itself
+FETCHERS: FetcherPool = None
+# embeds of finished matches waiting to be sent to their rooms
+OUTBOX = Outbox(OUTBOX_DELAY_SECONDS, OUTBOX_INTERVAL_SECONDS)
+# names of players shared by commands and the scanner, mostly filled from battle logs
+PLAYER_NAMES = PlayerNameCache(PLAYER_NAME_TTL, INVALID_TAG_TTL)
+
+
+# http server of the metrics endpoint and the task measuring event loop lag, None until the bot starts
+METRICS_SERVER = None
+LOOP_LAG_WATCHER: asyncio.Task = None
+# scan cycles profiled on demand by d!profile and sampled stacks of the event loop (None when sampling is off)
+PROFILER = CycleProfiler()
+SAMPLER: StackSampler = None
+
+
+# bot which also owns the pooled http session for all Brawl Stars API requests
+class ScrimBot(commands.Bot):
+    async def setup_hook(self) -> None:
+        global FETCHERS, METRICS_SERVER, LOOP_LAG_WATCHER, SAMPLER
+        await API.start()
+        if FETCH_WORKERS > 0:
+            FETCHERS = FetcherPool(FETCH_WORKERS, BS_API, BS_TOKEN, BS_API_RATE - MAIN_API_RATE,
+                                   max(1, BS_API_BURST - MAIN_API_BURST), MAX_CONCURRENT_REQUESTS,
+                                   BATTLE_LOG_ARCHIVE, FETCH_TIMEOUT_SECONDS)
+            FETCHERS.start()
+        LOOP_LAG_WATCHER = asyncio.create_task(
+            watch_loop_lag(LOOP_LAG_SECONDS))
+        if METRICS_PORT != 0:
+            try:
+                METRICS_SERVER = await start_metrics_server(METRICS, METRICS_HOST, METRICS_PORT)
+            except OSError as error:
+                print(f"Metrics endpoint couldn't be started: {error}")
+        if PROFILE_SAMPLE_SECONDS > 0:
+            SAMPLER = StackSampler(PROFILE_SAMPLE_SECONDS)
+            SAMPLER.start()
+
+    async def close(self) -> None:
+        if LOOP_LAG_WATCHER != None:
+            LOOP_LAG_WATCHER.cancel()
+        if METRICS_SERVER != None:
+            await METRICS_SERVER.cleanup()
+        if SAMPLER != None:
+            SAMPLER.stop()
+        await OUTBOX.drain()
+        await API.close()
+        if FETCHERS != None:
+            await FETCHERS.close()
+        await flush_all(STORES)
+        await super().close()
+
 
 # settings for bot
 activity = Activity(type=ActivityType.watching, name="Scrims")
 intents = Intents.default()
 intents.guilds = True
 intents.message_content = True
-bot = commands.Bot(
+bot = ScrimBot(
     command_prefix="d!", activity=activity, case_insensitive=True, intents=intents, help_command=None)
 
 # opening all json files
-# for servers and its players
-with open('servers.json', 'r+') as jsonfile:
-    SERVERS: dict = json.load(jsonfile)
+# for servers and its players, every server is loaded when it is needed
+SERVERS = GuildStore(SERVERS_DIR, 'servers.json', GUILD_CACHE_SIZE)
 
 # for emotes for brawlers
-with open('brawlers.json', 'r+') as jsonfile:
-    BRAWLER_EMOTES: dict = json.load(jsonfile)
+BRAWLER_EMOTES: dict = load_json('brawlers.json')
+
+# for settings of statistics (rooms and number of brawlers), every server is loaded when it is needed
+STATS = GuildStore(STATS_DIR, 'stats.json', GUILD_CACHE_SIZE)
+
+# for finished matches, statistics (playrate and winrate) are counted from them
+MATCHES = MatchStore(MATCHES_DB)
 
-# for statistics (playrate and winrate)
-with open('stats.json', 'r+') as jsonfile:
-    STATS: dict = json.load(jsonfile)
+# for the last processed battle of every player
+WATERMARKS: dict = load_json('watermarks.json')
+
+# files are written at most once per FLUSH_INTERVAL_SECONDS and on shutdown, servers only if they changed
+WATERMARKS_STORE = JsonStore('watermarks.json', WATERMARKS)
+STORES: List = [SERVERS, STATS, WATERMARKS_STORE, MATCHES]
+# fetched battle logs, written together with the other files (fetch workers have their own archives)
+ARCHIVE: BattleLogArchive = None
+if BATTLE_LOG_ARCHIVE != "":
+    ARCHIVE = BattleLogArchive(BATTLE_LOG_ARCHIVE)
+    STORES.append(ARCHIVE)
 
 # all needed global variables
 # maps we want to see matches from
@@ -46,25 +221,90 @@ MAPS_BOUNTY: tuple = ("Shooting Star", "Dry Season", "Layer Cake")
 MAPS_HEIST: tuple = ("Hot Potato", "Safe Zone", "Safe Zone")
 MAPS_KNOCKOUT: tuple = ("Goldarm Gulch", "Out in the Open", "Flaring Phoenix")
 MAPS_HOT_ZONE: tuple = ("Ring of Fire", "Parallel Plays", "Split")
-
-# variables to display mobile version of embed
-MESSAGES_STATS: List = []
-EMBEDS_MOBILE: List = []
-EMBEDS_PC: List = []
+# game modes of the weekly statistics
+STATS_MODES: tuple = ("Gem Grab", "Brawl Ball", "Bounty",
+                      "Heist", "Knockout", "Hot Zone")
+
+
+# embeds of statistics messages by message id to display mobile version of embed
+# least recently used messages are removed first when there are too many of them or they are too big
+class StatsMessages:
+    def __init__(self, max_messages: int, max_chars: int, ttl: float) -> None:
+        self.__max_messages = max_messages
+        self.__max_chars = max_chars
+        self.__ttl = ttl
+        # message id -> (normal embed, mobile embed, number of characters, time of expiration)
+        self.__messages: collections.OrderedDict = collections.OrderedDict()
+        self.__chars: int = 0
+
+    def add(self, message_id: int, embed: Embed, embed_mobile: Embed) -> None:
+        self.pop(message_id)
+        size: int = len(embed) + len(embed_mobile)
+        expires: float = datetime.datetime.timestamp(
+            datetime.datetime.now()) + self.__ttl
+        self.__messages[message_id] = (embed, embed_mobile, size, expires)
+        self.__chars += size
+        while len(self.__messages) > self.__max_messages or self.__chars > self.__max_chars:
+            self.pop(next(iter(self.__messages)))
+
+    # returns (normal embed, mobile embed) or None if the message isn´t cached
+    def get(self, message_id: int):
+        if message_id not in self.__messages:
+            return None
+        embed, embed_mobile, size, expires = self.__messages[message_id]
+        if expires < datetime.datetime.timestamp(datetime.datetime.now()):
+            self.pop(message_id)
+            return None
+        self.__messages.move_to_end(message_id)
+        return embed, embed_mobile
+
+    def pop(self, message_id: int) -> None:
+        if message_id in self.__messages:
+            self.__chars -= self.__messages.pop(message_id)[2]
+
+
+STATS_MESSAGES = StatsMessages(
+    STATS_CACHE_MESSAGES, STATS_CACHE_CHARS, STATS_CACHE_TTL)
+
+# last created embeds of statistics of the last STATS_DAYS days by (server id, mode), with the version of statistics they show
+RENDERED_STATS: Dict[tuple, tuple] = {}
+
+# every finished match changes the version of statistics of its server
+STATS_VERSIONS: Dict[str, int] = {}
 
 
 # object for creating and saving Power Matches (Best of 3)
+# players and brawlers are tuples with the team of the main player first, repeated names are interned
 class PowerMatch:
-    def __init__(self, playername: str, player1, player2, player3, player4, player5, player6, brawler1, brawler2, brawler3, brawler4, brawler5, brawler6, gamemode, bsmap, result: str, channel, bstype: str) -> None:
-        self.__players = [player1, player2, player3, player4, player5, player6]
-        self.__brawlers = [brawler1, brawler2,
-                           brawler3, brawler4, brawler5, brawler6]
-        self.__results = [result]
-        self.__gamemode = gamemode
-        self.__bstype = bstype
-        self.__map = bsmap
-        self.__playername = playername
+    __slots__ = ("__players", "__brawlers", "__results", "__times", "__gamemode",
+                 "__bstype", "__map", "__playername", "__channel", "__key")
+
+    def __init__(self, playername: str, players: Tuple[str, ...], brawlers: Tuple[str, ...], gamemode: str, bsmap: str, result: str, channel, bstype: str, timestamp: int) -> None:
+        self.__players: Tuple[str, ...] = tuple(
+            sys.intern(player) for player in players)
+        self.__brawlers: Tuple[str, ...] = tuple(
+            sys.intern(brawler) for brawler in brawlers)
+        self.__results: List[str] = [result]
+        # battle times of the games of the match
+        self.__times: List[int] = [timestamp]
+        self.__gamemode: str = sys.intern(gamemode)
+        self.__bstype: str = sys.intern(bstype)
+        self.__map: str = sys.intern(bsmap)
+        self.__playername: str = sys.intern(playername)
         self.__channel = channel
+        self.__key: tuple = match_key(
+            self.__players, self.__brawlers, self.__gamemode, self.__map, channel)
+
+    # creates Power Match straight from a battle of battle log, the team of the main player is put first
+    @classmethod
+    def from_battle(cls, battle: Battle, playername: str, channel):
+        players: Tuple[str, ...] = battle.players
+        brawlers: Tuple[str, ...] = battle.brawlers
+        if playername in players[3:]:
+            players = players[3:] + players[:3]
+            brawlers = brawlers[3:] + brawlers[:3]
+        return cls(playername, players, brawlers, mode_name(battle.mode), battle.map,
+                   battle.result.capitalize(), channel, battle.type, battle.time)
 
     # creating embed to send as a message
     def create_embed(self, result: str) -> Embed:
@@ -94,106 +334,109 @@ class PowerMatch:
         embed.add_field(name=f"**Results**", value=f"{results}", inline=False)
         return embed
 
-    # getting pickrate statistics from this match
-    def pickrate_stats(self) -> None:
+    # saving the finished match for statistics (pickrate and winrate)
+    def save_stats(self, won: bool, timestamp: float) -> None:
         server_id = str(self.__channel.guild.id)
-        if server_id not in STATS:
-            STATS[server_id] = {}
-        if self.__map not in STATS[server_id]:
-            STATS[server_id][self.__map] = {}
-        for brawler in self.__brawlers:
-            if brawler not in STATS[server_id][self.__map]:
-                STATS[server_id][self.__map][brawler] = {}
-            if "PICKS" not in STATS[server_id][self.__map][brawler]:
-                STATS[server_id][self.__map][brawler]["PICKS"] = 0
-            STATS[server_id][self.__map][brawler]["PICKS"] += 1
-        with open('stats.json', 'w') as jsonfile:
-            json.dump(STATS, jsonfile, indent=4)
-            jsonfile.truncate()
-
-    # getting winrate statistics from this match
-    def winrate_stats(self, won: bool) -> None:
-        server_id = str(self.__channel.guild.id)
-        if server_id not in STATS:
-            STATS[server_id] = {}
-        if self.__map not in STATS[server_id]:
-            STATS[server_id][self.__map] = {}
-        for brawler in self.__brawlers:
-            if brawler not in STATS[server_id][self.__map]:
-                STATS[server_id][self.__map][brawler] = {}
-            if "VICTORIES" not in STATS[server_id][self.__map][brawler]:
-                STATS[server_id][self.__map][brawler]["VICTORIES"] = 0
-        if won == True:
-            STATS[server_id][self.__map][self.__brawlers[0]]["VICTORIES"] += 1
-            STATS[server_id][self.__map][self.__brawlers[1]]["VICTORIES"] += 1
-            STATS[server_id][self.__map][self.__brawlers[2]]["VICTORIES"] += 1
-        else:
-            STATS[server_id][self.__map][self.__brawlers[3]]["VICTORIES"] += 1
-            STATS[server_id][self.__map][self.__brawlers[4]]["VICTORIES"] += 1
-            STATS[server_id][self.__map][self.__brawlers[5]]["VICTORIES"] += 1
-        with open('stats.json', 'w') as jsonfile:
-            json.dump(STATS, jsonfile, indent=4)
-            jsonfile.truncate()
+        MATCHES.add_match(server_id, self.__map, self.__gamemode,
+                          timestamp, self.__brawlers, won)
+        STATS_VERSIONS[server_id] = STATS_VERSIONS.get(server_id, 0) + 1
+        # rolling statistics which aren´t loaded yet get this match from the database
+        if server_id in ROLLING_STATS:
+            ROLLING_STATS[server_id].add_match(
+                timestamp, self.__map, self.__brawlers, won)
+        if server_id in LEADERBOARDS and timestamp >= LEADERBOARDS[server_id][0]:
+            LEADERBOARDS[server_id][1].add_match(
+                self.__map, self.__brawlers, won)
 
     # set the result of the played match, if the is one result twice then it has ended (Best of 3)
-    async def set_result(self, result: str, channel) -> bool:
+    async def set_result(self, result: str, channel, timestamp: float) -> bool:
+        self.__times.append(timestamp)
         if result in self.__results and (result == "Victory" or result == "Defeat"):
             self.__results.append(result)
-            self.pickrate_stats()
-            if result == "Victory":
-                self.winrate_stats(True)
-            elif result == "Defeat":
-                self.winrate_stats(False)
-            embed: Embed = self.create_embed(result)
-            await channel.send(embed=embed)
+            self.save_stats(result == "Victory", timestamp)
+            OUTBOX.post(channel, self.create_embed(result))
+            MATCHES_FINISHED.inc()
             return True
         else:
             self.__results.append(result)
             return False
 
-    # switch positions of players in the player list, so the team of the main player is always displayed as the first one
-    def switch_players(self, playername: str) -> None:
-        if playername == self.__players[3] or playername == self.__players[4] or playername == self.__players[5]:
-            self.__players[0], self.__players[3] = switch(
-                self.__players[0], self.__players[3])
-            self.__players[1], self.__players[4] = switch(
-                self.__players[1], self.__players[4])
-            self.__players[2], self.__players[5] = switch(
-                self.__players[2], self.__players[5])
-            self.__brawlers[0], self.__brawlers[3] = switch(
-                self.__brawlers[0], self.__brawlers[3])
-            self.__brawlers[1], self.__brawlers[4] = switch(
-                self.__brawlers[1], self.__brawlers[4])
-            self.__brawlers[2], self.__brawlers[5] = switch(
-                self.__brawlers[2], self.__brawlers[5])
-
     def get_playername(self) -> str:
         return self.__playername
 
-    # check if the match belongs to this Power Match
-    def is_the_same_match(self, players: List, brawlers: List, gamemode: str, bsmap: str, playername: str, channel) -> int:
-        if collections.Counter(self.__players) == collections.Counter(players):
-            if collections.Counter(self.__brawlers) == collections.Counter(brawlers):
-                if self.__gamemode == gamemode and self.__map == bsmap and self.__channel == channel:
-                    if self.__playername == playername:
-                        return 1
-                    else:
-                        return 2
-        if self.__playername == playername:
-            return 3
-        return 0
+    def get_key(self) -> tuple:
+        return self.__key
+
+    def get_times(self) -> List[int]:
+        return self.__times
+
+    def get_channel(self):
+        return self.__channel
+
+
+# key of a match which doesn´t depend on the order of players and brawlers, so the match can be found in a dictionary
+def match_key(players, brawlers, gamemode: str, bsmap: str, channel) -> tuple:
+    return (tuple(sorted(players)), tuple(sorted(brawlers)), gamemode, bsmap, channel.id)
+
+
+# key of the match a battle from battle log belongs to
+def battle_key(battle: Battle, channel) -> tuple:
+    return match_key(battle.players, battle.brawlers, mode_name(battle.mode), battle.map, channel)
 
 
-# list of matches which aren´t done yet
-POWER_MATCHES: List[PowerMatch] = []
+# fingerprint of one game of a match (its key and battle time), the same after restarts unlike hash()
+def game_fingerprint(key: tuple, time: int) -> int:
+    return int.from_bytes(hashlib.blake2b(repr((key, int(time))).encode(), digest_size=8).digest(), "big")
 
-# list of old matches, so the aren´t any duplicates
-OLD_MATCHES: List[PowerMatch] = []
+
+# matches which aren´t done yet by their key
+POWER_MATCHES: Dict[tuple, PowerMatch] = {}
+
+# match which isn´t done yet of every main player in every room, by (playername, room id)
+PLAYER_MATCHES: Dict[tuple, PowerMatch] = {}
+
+# fingerprints of games of sent matches, so the same match from the battle log of another player isn´t sent again
+REPORTED_MATCHES = FingerprintStore(
+    'reported.json', REPORTED_MATCHES_TTL, REPORTED_MATCHES_MAX)
+STORES.append(REPORTED_MATCHES)
+
+
+# remembers all games of a sent match
+def report_match(power_match: PowerMatch) -> None:
+    for time in power_match.get_times():
+        REPORTED_MATCHES.add(game_fingerprint(power_match.get_key(), time))
+
+
+# saves a new match into both indexes of unfinished matches
+def open_match(power_match: PowerMatch) -> None:
+    POWER_MATCHES[power_match.get_key()] = power_match
+    PLAYER_MATCHES[(power_match.get_playername(),
+                    power_match.get_channel().id)] = power_match
+
+
+# removes a match from both indexes of unfinished matches
+def close_match(power_match: PowerMatch) -> None:
+    POWER_MATCHES.pop(power_match.get_key(), None)
+    player = (power_match.get_playername(), power_match.get_channel().id)
+    if PLAYER_MATCHES.get(player) is power_match:
+        PLAYER_MATCHES.pop(player)
+
+
+# the last game of the match was played recently, so the next one can still come
+def is_match_active(power_match: PowerMatch, timestamp_now: float) -> bool:
+    return timestamp_now - power_match.get_times()[-1] < OPEN_MATCH_SECONDS
+
+
+# forgets matches which were abandoned after one game
+def prune_matches(timestamp_now: float) -> None:
+    for power_match in [power_match for power_match in POWER_MATCHES.values()
+                        if not is_match_active(power_match, timestamp_now)]:
+        close_match(power_match)
 
 
 async def send_help(ctx: Context) -> None:
     message: str = f"""__**SCRIMS BOT**__
-Spectating all scrims of professional players of your choice! Also sends weekly statistics on what are the most played brawlers!
+Spectating all scrims of professional players of your choice! Also sends weekly statistics of the last days on what are the most played brawlers!
     
 **d!help**: Displays the list of available commands
 **d!set_room [room_id]**: Sets the room where the bot will send all played scrims
@@ -201,21 +444,25 @@ Spectating all scrims of professional players of your choice! Also sends weekly
 **d!add_player [player_tag]**: Adds a player to the list of tracked players for friendly games
 **d!remove_player [player_tag]**: Removes a player from the list of tracked players for scrims
 **d!player_list**: Displays the list of tracked players for scrims
-**d!get_stats [mode]:** Displays the weekly statistics for the specified game mode. Supported game modes are: Gem Grab, Brawl Ball, Bounty, Heist, Knockout and Hot Zone
+**d!get_stats [mode] [days]:** Displays the statistics of the last 7 days for the specified game mode, or of the last days if the number of days is given. Supported game modes are: Gem Grab, Brawl Ball, Bounty, Heist, Knockout and Hot Zone
 **d!set_stats_count [number]:** Changes number of brawlers to show stats of (15 without setting, mobile capped at 20). 
 """
     await ctx.send(message)
 
 
-# get in-game name of a player from Brawl Stars API by his game tag
-async def get_playername(playertag: str) -> str:
-    async with aiohttp.ClientSession() as session:
-        async with session.get(f"{BS_API}/players/%23{playertag}", headers={"authorization": BS_TOKEN}) as response:
-            if response.status == 200:
-                data = await response.json()
-                return str(data["name"])
-            else:
-                return "error"
+# get in-game name of a player by their game tag, Brawl Stars API is asked only if the name isn´t cached
+async def get_playername(playertag: str, priority: int = BACKGROUND) -> str:
+    found, playername = PLAYER_NAMES.get(playertag)
+    if found:
+        return playername if playername is not None else "error"
+    status, data = await API.get(f"/players/%23{playertag}", priority)
+    if status == 200:
+        PLAYER_NAMES.set(playertag, str(data["name"]))
+        return str(data["name"])
+    else:
+        if status == 404:
+            PLAYER_NAMES.set_invalid(playertag)
+        return "error"
 
 
 # returns better text of gamemodes do display
@@ -272,218 +519,327 @@ def get_map_mode(map: str) -> int:
         return ""
 
 
-def switch(p1: str, p2: str):
-    pom: str = p1
-    p1 = p2
-    p2 = pom
-    return p1, p2
-
-
 # gets one battle and sends it to object Power Match
-async def send_battle(battle: dict, playername: str, channel) -> None:
-    brawlers: List[str] = []
-    brawlers.append(battle["battle"]["teams"][0][0]["brawler"]["name"])
-    brawlers.append(battle["battle"]["teams"][0][1]["brawler"]["name"])
-    brawlers.append(battle["battle"]["teams"][0][2]["brawler"]["name"])
-    brawlers.append(battle["battle"]["teams"][1][0]["brawler"]["name"])
-    brawlers.append(battle["battle"]["teams"][1][1]["brawler"]["name"])
-    brawlers.append(battle["battle"]["teams"][1][2]["brawler"]["name"])
-    players: List[str] = []
-    players.append(battle["battle"]["teams"][0][0]["name"])
-    players.append(battle["battle"]["teams"][0][1]["name"])
-    players.append(battle["battle"]["teams"][0][2]["name"])
-    players.append(battle["battle"]["teams"][1][0]["name"])
-    players.append(battle["battle"]["teams"][1][1]["name"])
-    players.append(battle["battle"]["teams"][1][2]["name"])
-    mode: str = mode_name(battle["battle"]["mode"])
-    result: str = battle["battle"]["result"].capitalize()
-    bsmap: str = battle['event']['map']
-    if get_map_mode(bsmap) != "":
-        for power_match in POWER_MATCHES:
-            is_the_same: int = power_match.is_the_same_match(
-                players, brawlers, mode, bsmap, playername, channel)
-            if is_the_same == 1:
+async def send_battle(battle: Battle, playername: str, channel) -> None:
+    if get_map_mode(battle.map) != "":
+        result: str = battle.result.capitalize()
+        key: tuple = battle_key(battle, channel)
+        power_match = POWER_MATCHES.get(key)
+        if power_match != None:
+            if power_match.get_playername() == playername:
                 # the match is already being played
-                if await power_match.set_result(result, channel) == True:
-                    OLD_MATCHES.append(power_match)
-                    POWER_MATCHES.remove(power_match)
-                    return
-            elif is_the_same == 2:
-                # the match is already being played but from another player
-                return
-            elif is_the_same == 3:
-                # its wasnt a Power Match (not played 2 matches)
-                POWER_MATCHES.remove(power_match)
-        for match in OLD_MATCHES:
-            if match.is_the_same_match(players, brawlers, mode, bsmap, playername, channel) == 2:
-                return
+                if await power_match.set_result(result, channel, battle.time) == True:
+                    close_match(power_match)
+                    report_match(power_match)
+            # else the match is already being played but from another player
+            return
+        power_match = PLAYER_MATCHES.get((playername, channel.id))
+        if power_match != None:
+            # its wasnt a Power Match (not played 2 matches)
+            close_match(power_match)
+        if game_fingerprint(key, battle.time) in REPORTED_MATCHES:
+            return
         # creating new Power Match object
-        power_match = PowerMatch(playername, players[0], players[1], players[2], players[3], players[4], players[5], brawlers[0],
-                                 brawlers[1], brawlers[2], brawlers[3], brawlers[4], brawlers[5], mode, bsmap, result, channel, battle["battle"]["type"])
-        power_match.switch_players(playername)
-        POWER_MATCHES.append(power_match)
+        power_match = PowerMatch.from_battle(battle, playername, channel)
+        open_match(power_match)
         return
     return
 
 
-# checks battle log and sends every mode played not more than 10 minutes ago to send_battle()
-async def scanning_friendly_games(battle_logs: dict, timestamp_now):
-    OLD_MATCHES.clear()
-    for playername, data in battle_logs.items():
-        for battle in reversed(data[0]["items"]):
-            if "type" in battle["battle"]:
-                if (battle["battle"]["type"] == "friendly" or battle["battle"]["type"] == "tournament") and "teams" in battle["battle"]:
-                    if type(battle["battle"]["teams"]) == list and len(battle["battle"]["teams"]) == 2:
-                        if len(battle["battle"]["teams"][0]) == 3 and len(battle["battle"]["teams"][1]) == 3:
-                            date = battle["battleTime"]
-                            year = int(date[0:4])
-                            month = int(date[4:6])
-                            day = int(date[6:8])
-                            hour = int(date[9:11])
-                            minute = int(date[11:13])
-                            sec = int(date[13:15])
-                            time_of_battle = datetime.datetime(
-                                year, month, day, hour, minute, sec)
-                            timestamp_of_battle = datetime.datetime.timestamp(
-                                time_of_battle)
-                            if (timestamp_now - timestamp_of_battle) < 600:
-                                await send_battle(battle, playername, data[1])
-
-
-# gets battle log of a certain played
-async def get_battle_logs(server_id, players: dict, channel) -> dict:
-    battle_logs: dict = {}
+# returns battles of a player newer than their watermark (oldest first) and moves the watermark to the newest battle
+# players without a watermark get battles from the last SCAN_INTERVAL_MINUTES
+def new_battles(player: str, battle_log: List[Battle], timestamp_now: float) -> List[Battle]:
+    tag: str = normalize_tag(player)
+    watermark: dict = WATERMARKS.get(tag)
+    battles: List[Battle] = []
+    # battle log has the newest battles first, so we can stop at the first already seen battle
+    for battle in battle_log:
+        if watermark == None:
+            if timestamp_now - battle.time >= SCAN_INTERVAL_MINUTES * 60:
+                break
+        elif battle.time < watermark["time"]:
+            break
+        elif battle.time == watermark["time"] and watermark["fingerprint"] in (None, battle.fingerprint):
+            break
+        battles.append(battle)
+    if len(battle_log) > 0:
+        WATERMARKS[tag] = {"time": battle_log[0].time,
+                           "fingerprint": battle_log[0].fingerprint}
+    battles.reverse()
+    return battles
+
+
+# sends new battles of one player (oldest first) to send_battle() in every room tracking them
+# battle logs have only 3v3 friendly and tournament games
+async def scanning_friendly_games(tag: str, battle_log: List[Battle], playername: str, subscriptions: set, timestamp_now: float) -> None:
+    battles: List[Battle] = new_battles(tag, battle_log, timestamp_now)
+    channels: set = set()
+    for server_id, channel, player in subscriptions:
+        # names are compared in the index, so servers are loaded only when a name changes
+        if playername != "error" and tracked_players(server_id).get(player, playername) != playername:
+            SERVERS[server_id]["players"][player] = playername
+            SERVERS.mark_dirty(server_id)
+            index_server(server_id)
+        # the same player can be added to one server more times with differently written tags
+        if channel.id in channels:
+            continue
+        channels.add(channel.id)
+        for battle in battles:
+            await send_battle(battle, playername, channel)
+
+
+# gets normalized battle log of a certain player (in a fetcher process if there are any), returns None when the request failed
+async def get_battle_log(player: str):
+    if FETCHERS != None:
+        sent: float = perf_counter()
+        status, name, battles = await FETCHERS.fetch(player)
+        # requests of fetch workers are measured here, including waiting for the worker
+        API_SECONDS.observe(perf_counter() - sent,
+                            "battlelog (worker)", str(status))
+    else:
+        status, data = await API.get(f"/players/%23{player}/battlelog", raw=True)
+        if status == 200:
+            if ARCHIVE != None:
+                ARCHIVE.add(player, datetime.datetime.timestamp(
+                    datetime.datetime.now()), data)
+            try:
+                name, battles = decode_battle_log(player, data)
+            except ValueError as error:
+                status = 0
+                print(f"Battle log of {player} couldn't be decoded: {error}")
+    if status == 200:
+        if name != None:
+            PLAYER_NAMES.set(player, name)
+        return battles
+    else:
+        if status == 404:
+            PLAYER_NAMES.set_invalid(player)
+        print(f"Battle log of {player} couldn't be fetched ({status}).")
+        return None
+
+
+# gets battle log and in-game name of one player, the name is usually already cached from the battle log
+async def get_player_data(player: str):
+    battles = await get_battle_log(player)
+    if battles is None:
+        return None, "error"
+    return battles, await get_playername(player)
+
+
+# fetches battle logs of players from the shared iterator and puts (tag, battles, playername) into the queue
+# battles are None when the battle log couldn´t be fetched, a full queue stops fetching until detection catches up
+async def fetch_battle_logs(players, queue: asyncio.Queue) -> None:
     for player in players:
-        async with aiohttp.ClientSession() as session:
-            async with session.get(f"{BS_API}/players/%23{player}/battlelog", headers={"authorization": BS_TOKEN}) as response:
-                if response.status == 200:
-                    data = await response.json()
-                    playername: str = await get_playername(player)
-                    if playername != "error":
-                        SERVERS[server_id]["players"][player] = playername
-                    battle_logs[playername] = (data, channel)
-                else:
-                    print(await response.json())
-    return battle_logs
+        battles, playername = None, "error"
+        try:
+            battles, playername = await get_player_data(player)
+        except Exception as error:
+            print(f"Battle log of {player} couldn't be fetched: {error}")
+        await queue.put((player, battles, playername))
+
+
+# picks and victories of the last STATS_BUCKETS buckets by servers, loaded from the database on first use
+# finished matches are added to their bucket and old buckets are reused, so statistics never have to be reset
+ROLLING_STATS: Dict[str, RollingStats] = {}
+
+
+def get_rolling_stats(server_id: str) -> RollingStats:
+    if server_id not in ROLLING_STATS:
+        timestamp_now: float = datetime.datetime.timestamp(
+            datetime.datetime.now())
+        rolling = RollingStats(STATS_BUCKET_SECONDS, STATS_BUCKETS)
+        since: float = (rolling.bucket_of(timestamp_now) -
+                        STATS_BUCKETS + 1) * STATS_BUCKET_SECONDS
+        for bucket, bsmap, brawler, picks, victories in MATCHES.brawler_stats_by_bucket(
+                server_id, since, timestamp_now + 1, STATS_BUCKET_SECONDS):
+            rolling.add(bucket, bsmap, brawler, picks, victories)
+        ROLLING_STATS[server_id] = rolling
+    return ROLLING_STATS[server_id]
+
+
+# number of buckets covering the last days
+def stats_buckets(days: int) -> int:
+    return max(1, -(-days * 86400 // STATS_BUCKET_SECONDS))
+
+
+# time window of statistics of the last days (STATS_DAYS without days), starts at the start of a bucket
+def stats_window(days: int = None) -> Tuple[float, float]:
+    timestamp_now: float = datetime.datetime.timestamp(datetime.datetime.now())
+    days = STATS_DAYS if days == None else days
+    bucket: int = int(timestamp_now // STATS_BUCKET_SECONDS)
+    return (bucket - stats_buckets(days) + 1) * STATS_BUCKET_SECONDS, timestamp_now + 1
+
+
+# leaderboards of brawlers of the last STATS_DAYS days by servers, with the start of their window
+# every finished match moves its brawlers in O(1), so rendering needs only the top brawlers
+# leaderboards can´t forget matches, they are built again from the rolling statistics when a new bucket starts
+LEADERBOARDS: Dict[str, Tuple[float, GuildLeaderboards]] = {}
+
+
+def get_leaderboards(server_id: str) -> GuildLeaderboards:
+    since, until = stats_window(STATS_DAYS)
+    if server_id not in LEADERBOARDS or LEADERBOARDS[server_id][0] != since:
+        LEADERBOARDS[server_id] = (since, GuildLeaderboards(get_rolling_stats(server_id).rows(
+            until - 1, stats_buckets(STATS_DAYS)), get_map_mode))
+    return LEADERBOARDS[server_id][1]
+
+
+# counts statistics of a server for all game modes at once from the last days
+# windows which fit into the rolling statistics are summed from their buckets, longer ones are read from the database
+def load_guild_stats(server_id: str, days: int = None) -> GuildStats:
+    days = STATS_DAYS if days == None else days
+    since, until = stats_window(days)
+    if stats_buckets(days) <= STATS_BUCKETS:
+        rows = get_rolling_stats(server_id).rows(until - 1, stats_buckets(days))
+    else:
+        rows = MATCHES.brawler_stats(server_id, since, until)
+    return GuildStats(rows, get_map_mode)
+
+
+def stats_description(days: int = None) -> str:
+    if days == None or days == STATS_DAYS:
+        return "Pickrates and Winrates"
+    return f"Pickrates and Winrates of the last {days} days"
+
+
+# creates normal and mobile embed of statistics (pickrate and winrate) of one game mode
+# guild_stats is GuildStats or GuildLeaderboards
+def create_stats_embeds(guild_stats, mode: str, mode_emote: str, count: int, description: str) -> Tuple[Embed, Embed]:
+    embed = Embed(title=f"**BRAWLERS STATS**",
+                  description=description, color=0x5900ff)
+    # for mobile version of discord (normal embed is not showing correctly)
+    embed_mobile = Embed(title=f"**BRAWLERS STATS**",
+                         description=description, color=0x5900ff)
+    embed.add_field(
+        name=f"__**{mode}**__ {mode_emote}", value=f"\n", inline=False)
+    embed_mobile.add_field(
+        name=f"__**{mode}**__ {mode_emote}", value=f"\n", inline=False)
+    count_mobile: int = 20
+    for map in guild_stats.maps_of(mode):
+        message_brawlers: str = ""
+        message_pickrate: str = ""
+        message_winrate: str = ""
+        message_mobile: str = ""
+        # brawlers are sorted by pickrate
+        top_brawlers = guild_stats.top(map, max(count, count_mobile))
+        for brawler, pickrate, winrate in top_brawlers[:count]:
+            emote: str = BRAWLER_EMOTES.get(brawler, "")
+            message_brawlers = message_brawlers + f"{emote} {brawler}\n"
+            message_pickrate = message_pickrate + f"{int(pickrate)} %\n"
+            message_winrate = message_winrate + f"{int(winrate)} %\n"
+        for brawler, pickrate, winrate in top_brawlers[:min(count, count_mobile)]:
+            emote: str = BRAWLER_EMOTES.get(brawler, "")
+            message_mobile = message_mobile + \
+                f"{emote} {brawler} {int(pickrate)} % {int(winrate)} %\n"
+        embed.add_field(
+            name=f"{map}", value=f"{message_brawlers}", inline=True)
+        embed.add_field(
+            name=f"-PR-", value=f"{message_pickrate}", inline=True)
+        embed.add_field(
+            name=f"-WR-", value=f"{message_winrate}", inline=True)
+        embed.add_field(name=f"", value=f"", inline=False)
+        embed_mobile.add_field(
+            name=f"{map}", value=f"{message_mobile}", inline=False)
+    return embed, embed_mobile
 
 
 # calculates and creates a message of statistics (pickrate and winrate)
-async def get_stats(channel, mode: str) -> None:
+# without days the statistics are from the last STATS_DAYS days, otherwise from the last days
+# guild_stats can be given when statistics of more game modes are sent at once
+async def get_stats(channel, mode: str, days: int = None, guild_stats=None) -> None:
     server_id = str(channel.guild.id)
     mode_emote = get_mode_emote(mode)
     if mode_emote == "":
         await channel.send("Wrong gamemode.")
         return
-    if server_id in STATS and mode_emote != "":
-        if "COUNT" not in STATS[server_id]:
-            STATS[server_id]["COUNT"] = 15
-        embed = Embed(title=f"**BRAWLERS STATS**",
-                      description="Pickrates and Winrates", color=0x5900ff)
-        # for mobile version of discord (normal embed is not showing correctly)
-        embed_mobile = Embed(title=f"**BRAWLERS STATS**",
-                             description="Pickrates and Winrates", color=0x5900ff)
-        embed.add_field(
-            name=f"__**{mode}**__ {mode_emote}", value=f"\n", inline=False)
-        embed_mobile.add_field(
-            name=f"__**{mode}**__ {mode_emote}", value=f"\n", inline=False)
-        for map in STATS[server_id]:
-            if get_map_mode(map) == mode:
-                message_brawlers: str = ""
-                message_pickrate: str = ""
-                message_winrate: str = ""
-                message_mobile: str = ""
-                brawlers_stats: dict = {}
-                winrate: float = 0
-                picks: float = 0
-                victories: float = 0
-                for brawler, brawler_info in STATS[server_id][map].items():
-                    if "PICKS" in brawler_info:
-                        picks += float(brawler_info["PICKS"])
-                    if "VICTORIES" in brawler_info:
-                        victories += float(brawler_info["VICTORIES"])
-                for brawler, brawler_info in STATS[server_id][map].items():
-                    brawler_picks: float = float(brawler_info["PICKS"])
-                    brawler_victories: float = float(brawler_info["VICTORIES"])
-                    if brawler_picks > 0:
-                        # calculating the statistics
-                        pickrate: float = (brawler_picks/(picks/6))*100
-                        winrate: float = (brawler_victories/brawler_picks)*100
-                        brawlers_stats[brawler] = {
-                            "WINRATE": winrate, "PICKRATE": pickrate}
-                count: int = int(STATS[server_id]["COUNT"])
-                count_mobile: int = 20
-                # sorting the dictionary by pickrate
-                sorteddict: dict = collections.OrderedDict(
-                    sorted(brawlers_stats.items(), key=lambda t: t[1]["PICKRATE"]))
-                for brawler, brawler_stats in reversed(sorteddict.items()):
-                    if count > 0:
-                        emote: str
-                        if brawler in BRAWLER_EMOTES:
-                            emote = BRAWLER_EMOTES[brawler]
-                        else:
-                            emote = ""
-                        message_brawlers = message_brawlers + \
-                            f"{emote} {brawler}\n"
-                        message_pickrate = message_pickrate + \
-                            f"{int(brawler_stats['PICKRATE'])} %\n"
-                        message_winrate = message_winrate + \
-                            f"{int(brawler_stats['WINRATE'])} %\n"
-                        if count_mobile > 0:
-                            message_mobile = message_mobile + \
-                                f"{emote} {brawler} {int(brawler_stats['PICKRATE'])} % {int(brawler_stats['WINRATE'])} %\n"
-                            count_mobile -= 1
-                        count -= 1
-                embed.add_field(
-                    name=f"{map}", value=f"{message_brawlers}", inline=True)
-                embed.add_field(
-                    name=f"-PR-", value=f"{message_pickrate}", inline=True)
-                embed.add_field(
-                    name=f"-WR-", value=f"{message_winrate}", inline=True)
-                embed.add_field(name=f"", value=f"", inline=False)
-                embed_mobile.add_field(
-                    name=f"{map}", value=f"{message_mobile}", inline=False)
-        msg: Message = await channel.send(embed=embed)
-        await msg.add_reaction("📱")
-        MESSAGES_STATS.append(msg)
-        EMBEDS_MOBILE.append(embed_mobile)
-        EMBEDS_PC.append(embed)
+    if server_id not in STATS:
+        STATS[server_id] = {}
+    if "COUNT" not in STATS[server_id]:
+        STATS[server_id]["COUNT"] = 15
+    count: int = int(STATS[server_id]["COUNT"])
+    days = STATS_DAYS if days == None else days
+    since, until = stats_window(days)
+    if days == STATS_DAYS:
+        # embeds are created again only if a match has finished or a new bucket has started since the last time
+        version: tuple = (count, since, STATS_VERSIONS.get(server_id, 0))
+        rendered = RENDERED_STATS.get((server_id, mode))
+        if rendered != None and rendered[0] == version and guild_stats == None:
+            embed, embed_mobile = rendered[1]
+        else:
+            if guild_stats == None:
+                guild_stats = get_leaderboards(server_id)
+            embed, embed_mobile = create_stats_embeds(
+                guild_stats, mode, mode_emote, count, stats_description(days))
+            RENDERED_STATS[(server_id, mode)] = (
+                version, (embed, embed_mobile))
+    else:
+        if guild_stats == None:
+            guild_stats = load_guild_stats(server_id, days)
+        embed, embed_mobile = create_stats_embeds(
+            guild_stats, mode, mode_emote, count, stats_description(days))
+    msg: Message = await channel.send(embed=embed)
+    await msg.add_reaction("📱")
+    STATS_MESSAGES.add(msg.id, embed, embed_mobile)
+    MATCHES.save_stats_message(
+        msg.id, server_id, mode, days, since, until, count)
+
+
+# creates embeds of a statistics message again from the database, for messages sent before a restart
+def rebuild_stats_embeds(message_id: int):
+    info = MATCHES.stats_message(message_id)
+    if info == None:
+        return None
+    server_id, mode, days, since, until, count = info
+    guild_stats = GuildStats(MATCHES.brawler_stats(
+        server_id, since, until), get_map_mode)
+    embed, embed_mobile = create_stats_embeds(
+        guild_stats, mode, get_mode_emote(mode), count, stats_description(days))
+    STATS_MESSAGES.add(message_id, embed, embed_mobile)
+    return embed, embed_mobile
 
 
 @bot.event
 async def on_ready():
     loop_scan.start()
     loop_stats.start()
+    loop_flush.start()
 
 
 @bot.event
 async def on_server_join(guild):
     SERVERS[guild.id] = {}
+    index_server(str(guild.id))
     print(f"Joined {guild.id}")
 
 # when someone reacts to statistics message with mobile phone emote then the message changes to mobile version of it, works both ways
-
-
+# raw event, so it works also for messages sent before a restart
 @bot.event
-async def on_reaction_add(reaction, user):
-    i: int = 0
-    for message in MESSAGES_STATS:
-        if reaction.message == message and user.bot == False:
-            if str(reaction.emoji) == "📱":
-                await reaction.message.edit(embed=EMBEDS_MOBILE[i])
-                await reaction.message.clear_reactions()
-                await reaction.message.add_reaction("🖥️")
-            elif str(reaction.emoji) == "🖥️":
-                await reaction.message.edit(embed=EMBEDS_PC[i])
-                await reaction.message.clear_reactions()
-                await reaction.message.add_reaction("📱")
-            else:
-                reaction.remove(user)
-        i += 1
+async def on_raw_reaction_add(payload):
+    if payload.user_id == bot.user.id or (payload.member != None and payload.member.bot):
+        return
+    embeds = STATS_MESSAGES.get(payload.message_id)
+    if embeds == None:
+        embeds = rebuild_stats_embeds(payload.message_id)
+    channel = bot.get_channel(payload.channel_id)
+    if embeds == None or channel == None:
+        return
+    message = channel.get_partial_message(payload.message_id)
+    if str(payload.emoji) == "📱":
+        await message.edit(embed=embeds[1])
+        await message.clear_reactions()
+        await message.add_reaction("🖥️")
+    elif str(payload.emoji) == "🖥️":
+        await message.edit(embed=embeds[0])
+        await message.clear_reactions()
+        await message.add_reaction("📱")
+    else:
+        await message.remove_reaction(payload.emoji, Object(payload.user_id))
 
 
 @bot.event
 async def on_server_leave(guild):
     SERVERS.pop(guild.id, None)
+    index_server(str(guild.id))
 
 
 @bot.command(name="help")
@@ -502,10 +858,9 @@ async def set_room(ctx: Context, room: str) -> None:
         if guild not in SERVERS:
             SERVERS[guild] = {}
         SERVERS[guild]["room"] = int(room)
+        SERVERS.mark_dirty(guild)
+        index_server(guild)
         await ctx.send(f"Room set to {channel.name}.")
-        with open('servers.json', 'w') as jsonfile:
-            json.dump(SERVERS, jsonfile, indent=4)
-            jsonfile.truncate()
 
 
 # sets room where the statistics should be sent
@@ -519,16 +874,14 @@ async def set_room(ctx: Context, room: str) -> None:
         if guild not in STATS:
             STATS[guild] = {}
         STATS[guild]["stats_room"] = int(room)
+        STATS.mark_dirty(guild)
         await ctx.send(f"Stats room set to {channel.name}.")
-        with open('stats.json', 'w') as jsonfile:
-            json.dump(STATS, jsonfile, indent=4)
-            jsonfile.truncate()
 
 
 # adds a player by his id to json file of players to spectate
 @bot.command(name="add_player")
 async def add(ctx: Context, playertag: str) -> None:
-    playername: str = await get_playername(playertag)
+    playername: str = await get_playername(playertag, INTERACTIVE)
     if playername != "error":
         guild: str = str(ctx.guild.id)
         if guild not in SERVERS:
@@ -537,10 +890,9 @@ async def add(ctx: Context, playertag: str) -> None:
             SERVERS[guild]["players"] = {}
         if playertag not in SERVERS[guild]["players"]:
             SERVERS[guild]["players"][playertag] = playername
+            SERVERS.mark_dirty(guild)
+            index_server(guild)
             await ctx.send(f"Player {playername} added.")
-            with open('servers.json', 'w') as jsonfile:
-                json.dump(SERVERS, jsonfile, indent=4)
-                jsonfile.truncate()
         else:
             await ctx.send(f"Player {playername} was already added.")
     else:
@@ -559,6 +911,8 @@ async def remove(ctx: Context, playertag: str) -> None:
     if playertag in SERVERS[guild]["players"]:
         playername: str = SERVERS[guild]["players"][playertag]
         SERVERS[guild]["players"].pop(playertag, None)
+        SERVERS.mark_dirty(guild)
+        index_server(guild)
         await ctx.send(f"Player {playername} deleted.")
     else:
         await ctx.send(f"Player with playertag {playertag} is not in your player list.")
@@ -577,15 +931,23 @@ async def player_list(ctx: Context) -> None:
     else:
         message: str = "**Players:**\n"
         for playertag, playername in SERVERS[guild]["players"].items():
+            found, cached_name = PLAYER_NAMES.get(playertag)
+            if found and cached_name is not None:
+                playername = cached_name
             message = message + str(playername) + ": " + str(playertag) + "\n"
         await ctx.send(message)
 
 
-# shows statistics from last week
+# shows statistics from the last STATS_DAYS days, or from the last days when the number of days is written after the mode
 @bot.command(name="get_stats")
 async def stats(ctx: Context, *, mode: str) -> None:
     channel = ctx.channel
-    await get_stats(channel, mode)
+    days: int = None
+    words: List[str] = mode.rsplit(" ", 1)
+    if len(words) == 2 and words[1].isdigit():
+        mode = words[0]
+        days = int(words[1])
+    await get_stats(channel, mode, days)
 
 
 # sets number of brawlers to display when showing stats
@@ -596,58 +958,266 @@ async def stats(ctx: Context, count: int) -> None:
         if server_id not in STATS:
             STATS[server_id] = {}
         STATS[server_id]["COUNT"] = count
+        STATS.mark_dirty(server_id)
         await ctx.send(f"Number of brawlers to show stats of set to {count}.")
-        with open('stats.json', 'w') as jsonfile:
-            json.dump(STATS, jsonfile, indent=4)
-            jsonfile.truncate()
     else:
         await ctx.send(f"ERROR\nNumber of brawlers to show stats of must be 25 or lower.")
 
 
-# loop every 10 minutes, shows every match that has been played in those 10 minutes
-@tasks.loop(minutes=10)
-async def loop_scan() -> None:
+# milliseconds of a histogram summary for d!perf
+def format_summary(histogram: Histogram, labels: tuple = ()) -> str:
+    count, average, p95, last = histogram.summary(labels)
+    if count == 0:
+        return "no data"
+    return f"{count}x, last {last * 1000:.0f} ms, avg {average * 1000:.0f} ms, p95 <= {p95 * 1000:.0f} ms"
+
+
+# shows a summary of metrics of the bot, only for the owner of the bot
+@bot.command(name="perf")
+@commands.is_owner()
+async def perf(ctx: Context) -> None:
+    message: str = f"""__**PERFORMANCE**__
+**Scan cycles:** {format_summary(SCAN_SECONDS)}
+**Players polled:** {int(SCANNED_PLAYERS.total())} ({len(POLL_WHEEL)} planned)
+**API scheduler:** {API.stats()}
+"""
+    for labels in sorted(API_SECONDS.values):
+        message = message + \
+            f"**API {labels[0]} {labels[1]}:** {format_summary(API_SECONDS, labels)}\n"
+    message = message + f"""**Open Power Matches:** {len(POWER_MATCHES)}, reported games: {len(REPORTED_MATCHES)}
+**Finished matches:** {int(MATCHES_FINISHED.total())}, waiting to be sent: {len(OUTBOX)}, sent {OUTBOX.embeds} in {OUTBOX.messages} messages, failed: {OUTBOX.failed}
+**Flush:** {format_summary(FLUSH_SECONDS)}
+**Event loop lag:** {format_summary(LOOP_LAG_SECONDS)}
+"""
+    await ctx.send(message)
+
+
+# profiles the next scan cycles (d!profile 3), one statistics message (d!profile stats Gem Grab) or shows
+# sampled stacks (d!profile sample), the report is sent as a file, only for the owner of the bot
+@bot.command(name="profile")
+@commands.is_owner()
+async def profile(ctx: Context, *, target: str = "1") -> None:
+    words: List[str] = target.split(" ", 1)
+    if words[0] == "sample":
+        if SAMPLER == None:
+            await ctx.send("Sampling is off, set PROFILE_SAMPLE_SECONDS to turn it on.")
+            return
+        report: str = SAMPLER.report()
+        filename: str = "sample.txt"
+    elif words[0] == "stats":
+        if PROFILER.busy or ProfileCapture.running != None:
+            await ctx.send("Something is being profiled already.")
+            return
+        mode: str = words[1] if len(words) == 2 else STATS_MODES[0]
+        capture = ProfileCapture()
+        capture.start()
+        try:
+            await get_stats(ctx.channel, mode)
+        finally:
+            report: str = capture.stop(f"get_stats {mode}")
+        filename: str = "profile-stats.txt"
+    elif words[0].isdigit() and int(words[0]) > 0:
+        report_future: asyncio.Future = PROFILER.request(int(words[0]))
+        if report_future == None:
+            await ctx.send("Something is being profiled already.")
+            return
+        await ctx.send(f"Profiling the next {words[0]} scan cycles.")
+        try:
+            report: str = await asyncio.wait_for(report_future, PROFILE_TIMEOUT_SECONDS)
+        except asyncio.TimeoutError:
+            PROFILER.cancel()
+            await ctx.send(f"No scan cycles were profiled in {PROFILE_TIMEOUT_SECONDS:.0f} s, profiling stopped.")
+            return
+        except Exception as error:
+            await ctx.send(f"Profiling failed: {error!r}")
+            return
+        filename: str = "profile-scan.txt"
+    else:
+        await ctx.send("Use d!profile [cycles], d!profile stats [mode] or d!profile sample.")
+        return
+    await ctx.send(file=File(io.BytesIO(report.encode()), filename=filename))
+
+
+# room and players (tag -> name) of every server with a room, so scans don´t have to load all servers
+# read from all servers on the first scan and changed by commands which change the server
+TRACKED_PLAYERS: Dict[str, Tuple[int, Dict[str, str]]] = None
+
+
+def get_tracked_players() -> Dict[str, Tuple[int, Dict[str, str]]]:
+    global TRACKED_PLAYERS
+    if TRACKED_PLAYERS == None:
+        TRACKED_PLAYERS = {}
+        for server_id, server_info in SERVERS.items():
+            if "room" in server_info and "players" in server_info:
+                TRACKED_PLAYERS[server_id] = (
+                    server_info["room"], dict(server_info["players"]))
+    return TRACKED_PLAYERS
+
+
+# players of one server from the index, empty when the server has no room
+def tracked_players(server_id: str) -> Dict[str, str]:
+    return get_tracked_players().get(server_id, (None, {}))[1]
+
+
+# updates the index after a server has changed
+def index_server(server_id: str) -> None:
+    server_info: dict = SERVERS.get(server_id, {})
+    if "room" in server_info and "players" in server_info:
+        get_tracked_players()[server_id] = (
+            server_info["room"], dict(server_info["players"]))
+    else:
+        get_tracked_players().pop(server_id, None)
+
+
+# every tracked player with all servers (and their rooms) tracking them, so each player is fetched only once
+def get_subscribers() -> dict:
+    subscribers: dict = collections.defaultdict(set)
+    for server_id, (room, players) in get_tracked_players().items():
+        guild = bot.get_guild(int(server_id))
+        channel = guild.get_channel(room) if guild != None else None
+        if channel != None:
+            for player in players:
+                subscribers[normalize_tag(player)].add(
+                    (server_id, channel, player))
+    return subscribers
+
+
+# how long to wait before the next poll of a player
+# players in the middle of a Power Match are polled often, players who haven´t played for days rarely
+def poll_interval(tag: str, subscriptions: set, timestamp_now: float) -> float:
+    for server_id, channel, player in subscriptions:
+        playername: str = tracked_players(server_id).get(player)
+        power_match = PLAYER_MATCHES.get((playername, channel.id))
+        if power_match != None and is_match_active(power_match, timestamp_now):
+            return ACTIVE_POLL_SECONDS
+    watermark: dict = WATERMARKS.get(normalize_tag(tag))
+    if watermark != None and timestamp_now - watermark["time"] > IDLE_AFTER_DAYS * 86400:
+        return IDLE_POLL_SECONDS
+    return SCAN_INTERVAL_MINUTES * 60
+
+
+# fetches battle logs of the players and shows every match played since their last poll
+# every battle log goes to detection as soon as it arrives, only SCAN_QUEUE_SIZE of them wait in memory
+async def scan_players(tags: List[str], subscribers: dict) -> None:
     now = datetime.datetime.now()
     timestamp_now = datetime.datetime.timestamp(now)
-    battle_logs: dict = {}
-    for server_id, server_info in SERVERS.items():
-        if "room" in server_info and "players" in server_info:
-            channel = bot.get_guild(
-                int(server_id)).get_channel(server_info["room"])
-            if channel != None:
-                battle_logs[server_id] = await get_battle_logs(server_id, server_info["players"], channel)
-    for server in battle_logs:
-        await scanning_friendly_games(battle_logs[server], timestamp_now)
-
-    with open('servers.json', 'w') as jsonfile:
-        json.dump(SERVERS, jsonfile, indent=4)
-        jsonfile.truncate()
-
-
-# loop every 7 days, shows statistics of all gamemodes
+    throttled: int = API.throttled
+    # tags which don´t exist aren´t asked for again until their cache entry expires
+    tags = [tag for tag in tags if not PLAYER_NAMES.is_invalid(tag)]
+    queue: asyncio.Queue = asyncio.Queue(SCAN_QUEUE_SIZE)
+    players = iter(tags)
+    # the scheduler of the API decides how fast the requests are sent
+    fetchers: List[asyncio.Task] = [asyncio.create_task(fetch_battle_logs(players, queue))
+                                    for _ in range(min(MAX_CONCURRENT_REQUESTS, len(tags)))]
+    fetched: int = 0
+    try:
+        for _ in range(len(tags)):
+            tag, battle_log, playername = await queue.get()
+            if battle_log is not None:
+                fetched += 1
+                await scanning_friendly_games(tag, battle_log, playername, subscribers[tag], timestamp_now)
+    finally:
+        for fetcher in fetchers:
+            fetcher.cancel()
+    if API.throttled > throttled:
+        print(
+            f"Brawl Stars API throttled {API.throttled - throttled} requests during the scan, {API.stats()}")
+    if fetched > 0:
+        WATERMARKS_STORE.mark_dirty()
+
+
+# players are polled one slot of the wheel per tick, each player has their own interval
+POLL_WHEEL = PollWheel(POLL_TICK_SECONDS, max(
+    IDLE_POLL_SECONDS, ACTIVE_POLL_SECONDS, SCAN_INTERVAL_MINUTES * 60) * (1 + POLL_JITTER))
+
+
+# loop every POLL_TICK_SECONDS seconds, polls players who are due and shows every match they played since their last poll
+@tasks.loop(seconds=POLL_TICK_SECONDS)
+async def loop_scan() -> None:
+    prune_matches(datetime.datetime.timestamp(datetime.datetime.now()))
+    subscribers: dict = get_subscribers()
+    for tag in subscribers:
+        if tag not in POLL_WHEEL:
+            POLL_WHEEL.schedule_new(tag, SCAN_INTERVAL_MINUTES * 60)
+    tracked: set = {normalize_tag(player) for room, players in get_tracked_players().values()
+                    for player in players}
+    for tag in POLL_WHEEL.tags():
+        if tag not in tracked:
+            # watermarks of players nobody tracks anymore aren´t needed
+            POLL_WHEEL.remove(tag)
+            WATERMARKS.pop(tag, None)
+            WATERMARKS_STORE.mark_dirty()
+    due: List[str] = []
+    for tag in POLL_WHEEL.advance():
+        if tag in subscribers:
+            due.append(tag)
+        elif tag in tracked:
+            # rooms which can´t be found now (Discord outage, incomplete cache) are tried again later,
+            # their players keep their watermarks
+            POLL_WHEEL.schedule(tag, SCAN_INTERVAL_MINUTES * 60, POLL_JITTER)
+    if len(due) == 0:
+        return
+    start: float = perf_counter()
+    # profiling never stops the scans
+    try:
+        PROFILER.begin()
+    except Exception as error:
+        print(f"Profiling of the scan failed: {error!r}")
+    try:
+        await scan_players(due, subscribers)
+    finally:
+        try:
+            PROFILER.end()
+        except Exception as error:
+            print(f"Profiling of the scan failed: {error!r}")
+    SCAN_SECONDS.observe(perf_counter() - start)
+    SCANNED_PLAYERS.inc(amount=len(due))
+    timestamp_now: float = datetime.datetime.timestamp(datetime.datetime.now())
+    for tag in due:
+        POLL_WHEEL.schedule(tag, poll_interval(
+            tag, subscribers[tag], timestamp_now), POLL_JITTER)
+
+
+# loop every FLUSH_INTERVAL_SECONDS seconds, writes changed json files
+@tasks.loop(seconds=FLUSH_INTERVAL_SECONDS)
+async def loop_flush() -> None:
+    start: float = perf_counter()
+    await flush_all(STORES)
+    FLUSH_SECONDS.observe(perf_counter() - start)
+
+
+# loop every 7 days, shows statistics of all gamemodes from the last STATS_DAYS days
 @tasks.loop(hours=168)
 async def loop_stats() -> None:
     if loop_stats.current_loop != 0:
-        if STATS != {}:
-            for server_id, stats_info in STATS.items():
-                if "stats_room" in stats_info:
-                    channel = bot.get_guild(int(server_id)).get_channel(
-                        stats_info["stats_room"])
-                    if channel != None:
-                        await get_stats(channel, "Gem Grab")
-                        await get_stats(channel, "Brawl Ball")
-                        await get_stats(channel, "Bounty")
-                        await get_stats(channel, "Heist")
-                        await get_stats(channel, "Knockout")
-                        await get_stats(channel, "Hot Zone")
-        # clears every list to save some space
-        STATS.clear()
-        MESSAGES_STATS.clear()
-        EMBEDS_MOBILE.clear()
-        EMBEDS_PC.clear()
-        with open('stats.json', 'w') as jsonfile:
-            json.dump(STATS, jsonfile, indent=4)
-            jsonfile.truncate()
-
-
-bot.run(TOKEN)
+        for server_id, stats_info in STATS.items():
+            if "stats_room" in stats_info:
+                channel = bot.get_guild(int(server_id)).get_channel(
+                    stats_info["stats_room"])
+                if channel != None:
+                    # statistics of the server for all game modes
+                    guild_stats: GuildLeaderboards = get_leaderboards(server_id)
+                    for mode in STATS_MODES:
+                        await get_stats(channel, mode, None, guild_stats)
+        timestamp_now: float = datetime.datetime.timestamp(
+            datetime.datetime.now())
+        # statistics messages older than the cache can´t be switched anymore
+        MATCHES.delete_stats_messages(timestamp_now - STATS_CACHE_TTL)
+
+
+# moves statistics from the old stats.json into the database, only settings stay in stats.json
+def migrate_stats() -> None:
+    if MATCHES.version() < LEGACY_STATS_IMPORTED:
+        MATCHES.import_legacy_stats(STATS, get_map_mode, datetime.datetime.timestamp(
+            datetime.datetime.now()))
+        for server_id in STATS.keys():
+            stats_info: dict = STATS[server_id]
+            # statistics of the last days don´t start at a weekly reset anymore
+            for key in [key for key, value in stats_info.items() if type(value) == dict or key == "since"]:
+                stats_info.pop(key)
+                STATS.mark_dirty(server_id)
+
+
+if __name__ == "__main__":
+    migrate_stats()
+    bot.run(TOKEN)
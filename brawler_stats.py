@@ -0,0 +1,190 @@
+from array import array
+from typing import Dict, List, Tuple
+import heapq
+
+
+# pick and victory matrices (map x brawler) of one server, counted in one pass for all game modes
+class GuildStats:
+    # rows are (map, brawler, picks, victories), map_mode returns the game mode of a map
+    def __init__(self, rows: List[Tuple[str, str, int, int]], map_mode) -> None:
+        self.brawlers: List[str] = sorted({row[1] for row in rows})
+        brawler_index: Dict[str, int] = {
+            brawler: i for i, brawler in enumerate(self.brawlers)}
+        # game mode -> maps of the game mode which were played
+        self.maps: Dict[str, List[str]] = {}
+        # map -> picks and victories of every brawler, brawlers are columns
+        self.picks: Dict[str, array] = {}
+        self.victories: Dict[str, array] = {}
+        # map -> number of picks of all brawlers
+        self.total_picks: Dict[str, int] = {}
+        empty = array('l', [0]) * len(self.brawlers)
+        for bsmap, brawler, picks, victories in rows:
+            if bsmap not in self.picks:
+                mode: str = map_mode(bsmap)
+                if mode not in self.maps:
+                    self.maps[mode] = []
+                self.maps[mode].append(bsmap)
+                self.picks[bsmap] = array('l', empty)
+                self.victories[bsmap] = array('l', empty)
+                self.total_picks[bsmap] = 0
+            column: int = brawler_index[brawler]
+            self.picks[bsmap][column] += int(picks)
+            self.victories[bsmap][column] += int(victories)
+            self.total_picks[bsmap] += int(picks)
+
+    def maps_of(self, mode: str) -> List[str]:
+        return self.maps.get(mode, [])
+
+    # the most picked brawlers of a map as (brawler, pickrate, winrate), pickrate is % of matches the brawler was in
+    def top(self, bsmap: str, count: int) -> List[Tuple[str, float, float]]:
+        picks: array = self.picks[bsmap]
+        victories: array = self.victories[bsmap]
+        matches: float = self.total_picks[bsmap] / 6
+        best: List[int] = heapq.nlargest(count, (column for column in range(len(picks)) if picks[column] > 0),
+                                         key=lambda column: picks[column])
+        return [(self.brawlers[column], (picks[column] / matches) * 100, (victories[column] / picks[column]) * 100)
+                for column in best]
+
+
+# brawlers of one map ordered by picks (so by pickrate), adding a match moves every brawler in O(1)
+# brawlers with the same number of picks are next to each other, a picked brawler is swapped with the first of them
+class Leaderboard:
+    def __init__(self) -> None:
+        self.__order: List[str] = []
+        self.__position: Dict[str, int] = {}
+        self.__picks: Dict[str, int] = {}
+        self.__victories: Dict[str, int] = {}
+        # number of picks -> position of the first brawler with that number of picks
+        self.__first: Dict[int, int] = {}
+        self.total_picks: int = 0
+
+    # creates leaderboard from counted statistics {brawler: (picks, victories)}
+    @classmethod
+    def from_counts(cls, counts: Dict[str, Tuple[int, int]]):
+        leaderboard = cls()
+        for brawler, (picks, victories) in sorted(counts.items(), key=lambda item: -item[1][0]):
+            if picks > 0:
+                leaderboard.__first.setdefault(picks, len(leaderboard.__order))
+                leaderboard.__position[brawler] = len(leaderboard.__order)
+                leaderboard.__order.append(brawler)
+                leaderboard.__picks[brawler] = picks
+                leaderboard.__victories[brawler] = victories
+                leaderboard.total_picks += picks
+        return leaderboard
+
+    def __swap(self, i: int, j: int) -> None:
+        self.__order[i], self.__order[j] = self.__order[j], self.__order[i]
+        self.__position[self.__order[i]] = i
+        self.__position[self.__order[j]] = j
+
+    # adds one pick of a brawler
+    def add(self, brawler: str, won: bool) -> None:
+        if brawler not in self.__picks:
+            self.__position[brawler] = len(self.__order)
+            self.__order.append(brawler)
+            self.__picks[brawler] = 0
+            self.__victories[brawler] = 0
+            self.__first.setdefault(0, self.__position[brawler])
+        picks: int = self.__picks[brawler]
+        first: int = self.__first[picks]
+        self.__swap(self.__position[brawler], first)
+        # the brawler is now the last one with picks + 1
+        if first + 1 < len(self.__order) and self.__picks[self.__order[first + 1]] == picks:
+            self.__first[picks] = first + 1
+        else:
+            del self.__first[picks]
+        self.__first.setdefault(picks + 1, first)
+        self.__picks[brawler] = picks + 1
+        self.__victories[brawler] += int(won)
+        self.total_picks += 1
+
+    # the most picked brawlers as (brawler, pickrate, winrate), same as GuildStats.top()
+    def top(self, count: int) -> List[Tuple[str, float, float]]:
+        matches: float = self.total_picks / 6
+        return [(brawler, (self.__picks[brawler] / matches) * 100, (self.__victories[brawler] / self.__picks[brawler]) * 100)
+                for brawler in self.__order[:count]]
+
+
+# leaderboards of all maps of one server, updated by every finished match
+# has the same maps_of() and top() as GuildStats, so embeds can be created from both
+class GuildLeaderboards:
+    # rows are (map, brawler, picks, victories), map_mode returns the game mode of a map
+    def __init__(self, rows: List[Tuple[str, str, int, int]], map_mode) -> None:
+        self.__map_mode = map_mode
+        self.maps: Dict[str, List[str]] = {}
+        self.leaderboards: Dict[str, Leaderboard] = {}
+        counts: Dict[str, Dict[str, Tuple[int, int]]] = {}
+        for bsmap, brawler, picks, victories in rows:
+            if bsmap not in counts:
+                counts[bsmap] = {}
+            counts[bsmap][brawler] = (int(picks), int(victories))
+        for bsmap, map_counts in counts.items():
+            self.__add_map(bsmap, Leaderboard.from_counts(map_counts))
+
+    def __add_map(self, bsmap: str, leaderboard: Leaderboard) -> None:
+        mode: str = self.__map_mode(bsmap)
+        if mode not in self.maps:
+            self.maps[mode] = []
+        self.maps[mode].append(bsmap)
+        self.leaderboards[bsmap] = leaderboard
+
+    # adds a finished match, brawlers of the winning team are the first three if won is True
+    def add_match(self, bsmap: str, brawlers: Tuple[str, ...], won: bool) -> None:
+        if bsmap not in self.leaderboards:
+            self.__add_map(bsmap, Leaderboard())
+        for i, brawler in enumerate(brawlers):
+            self.leaderboards[bsmap].add(brawler, won == (i < 3))
+
+    def maps_of(self, mode: str) -> List[str]:
+        return self.maps.get(mode, [])
+
+    def top(self, bsmap: str, count: int) -> List[Tuple[str, float, float]]:
+        return self.leaderboards[bsmap].top(count)
+
+
+# picks and victories of brawlers of one server in a ring of time buckets (days), so statistics of the last buckets
+# are counted by summing a few of them, the oldest bucket is reused for a new one and its matches expire
+class RollingStats:
+    def __init__(self, bucket_seconds: float, buckets: int) -> None:
+        self.bucket_seconds = bucket_seconds
+        self.buckets = buckets
+        # ring of (number of the bucket, {(map, brawler): [picks, victories]}), number is time // bucket_seconds
+        self.__ring: List[Tuple[int, Dict[Tuple[str, str], List[int]]]] = [
+            (-1, {}) for _ in range(buckets)]
+
+    def bucket_of(self, timestamp: float) -> int:
+        return int(timestamp // self.bucket_seconds)
+
+    # adds picks and victories of a brawler in a bucket, buckets older than the ring are ignored
+    def add(self, bucket: int, bsmap: str, brawler: str, picks: int, victories: int) -> None:
+        number, counts = self.__ring[bucket % self.buckets]
+        if number > bucket:
+            return
+        if number < bucket:
+            counts = {}
+            self.__ring[bucket % self.buckets] = (bucket, counts)
+        if (bsmap, brawler) not in counts:
+            counts[(bsmap, brawler)] = [0, 0]
+        counts[(bsmap, brawler)][0] += int(picks)
+        counts[(bsmap, brawler)][1] += int(victories)
+
+    # adds a finished match, brawlers of the winning team are the first three if won is True
+    def add_match(self, timestamp: float, bsmap: str, brawlers: Tuple[str, ...], won: bool) -> None:
+        bucket: int = self.bucket_of(timestamp)
+        for i, brawler in enumerate(brawlers):
+            self.add(bucket, bsmap, brawler, 1, int(won == (i < 3)))
+
+    # (map, brawler, picks, victories) of the last buckets up to the bucket of now, same as MatchStore.brawler_stats()
+    def rows(self, now: float, buckets: int) -> List[Tuple[str, str, int, int]]:
+        newest: int = self.bucket_of(now)
+        total: Dict[Tuple[str, str], List[int]] = {}
+        for bucket in range(newest - min(buckets, self.buckets) + 1, newest + 1):
+            number, counts = self.__ring[bucket % self.buckets]
+            if number != bucket:
+                continue
+            for key, (picks, victories) in counts.items():
+                if key not in total:
+                    total[key] = [0, 0]
+                total[key][0] += picks
+                total[key][1] += victories
+        return [(bsmap, brawler, picks, victories) for (bsmap, brawler), (picks, victories) in total.items()]
@@ -0,0 +1,302 @@
+from time import monotonic
+from typing import Dict, List, Tuple
+import asyncio
+import collections
+import heapq
+import itertools
+import json
+import random
+import aiohttp
+
+# priorities of requests, requests with lower number are sent first
+INTERACTIVE: int = 0
+BACKGROUND: int = 1
+
+
+# central scheduler for all requests to Brawl Stars API
+# token bucket sized to the quota of the API key, honours Retry-After and retries with jittered backoff
+class RequestScheduler:
+    # latency is a metrics.Histogram with labels (endpoint, status), every response (and failed request) is observed
+    # responses are kept in cache (ResponseCache) as long as the API allows it
+    def __init__(self, url: str, token: str, rate: float, burst: int, max_concurrent: int, max_retries: int = 3, backoff: float = 1.0, latency=None, cache=None) -> None:
+        self.__url = url
+        self.__token = token
+        self.__rate = rate
+        self.__burst = burst
+        self.__max_concurrent = max_concurrent
+        self.__max_retries = max_retries
+        self.__backoff = backoff
+        self.__latency = latency
+        self.__cache: ResponseCache = cache
+        # path -> request being sent, everybody asking for the same path at the same time waits for it
+        self.__in_flight: Dict[str, asyncio.Future] = {}
+        # path -> priority of the request being sent and its entry waiting for a token, a caller with higher
+        # priority joining the request moves it forward
+        self.__priorities: Dict[str, int] = {}
+        self.__queued: Dict[str, list] = {}
+        self.__tokens: float = burst
+        self.__updated: float = monotonic()
+        self.__paused_until: float = 0
+        self.__waiting: List = []
+        self.__counter = itertools.count()
+        self.__dispatcher: asyncio.Task = None
+        self.__concurrency = asyncio.Semaphore(max_concurrent)
+        self.__session: aiohttp.ClientSession = None
+        # counters to see how close we are to the quota
+        self.requests: int = 0
+        self.throttled: int = 0
+        self.retried: int = 0
+        self.failed: int = 0
+        self.cache_hits: int = 0
+        self.coalesced: int = 0
+
+    # one pooled session for the whole life of the bot
+    async def start(self) -> None:
+        connector = aiohttp.TCPConnector(limit=self.__max_concurrent)
+        self.__session = aiohttp.ClientSession(
+            connector=connector, headers={"authorization": self.__token})
+
+    async def close(self) -> None:
+        if self.__dispatcher is not None:
+            self.__dispatcher.cancel()
+        if self.__session is not None:
+            await self.__session.close()
+
+    # number of requests waiting for a token
+    @property
+    def queue_depth(self) -> int:
+        return len(self.__waiting)
+
+    def stats(self) -> dict:
+        return {"requests": self.requests, "queue_depth": self.queue_depth, "throttled": self.throttled,
+                "retried": self.retried, "failed": self.failed, "cache_hits": self.cache_hits, "coalesced": self.coalesced}
+
+    # waits until the token bucket lets this request through, higher priority requests are let through first
+    async def __acquire(self, priority: int, path: str) -> None:
+        future = asyncio.get_running_loop().create_future()
+        entry: list = [priority, next(self.__counter), future]
+        heapq.heappush(self.__waiting, entry)
+        self.__queued[path] = entry
+        if self.__dispatcher is None or self.__dispatcher.done():
+            self.__dispatcher = asyncio.create_task(self.__dispatch())
+        try:
+            await future
+        finally:
+            if self.__queued.get(path) is entry:
+                del self.__queued[path]
+
+    # the request of the path is sent with the priority from now on, also when it is waiting for a token already
+    def __raise_priority(self, path: str, priority: int) -> None:
+        if priority >= self.__priorities.get(path, priority):
+            return
+        self.__priorities[path] = priority
+        entry: list = self.__queued.get(path)
+        if entry is not None and not entry[2].done():
+            entry[0] = priority
+            heapq.heapify(self.__waiting)
+
+    async def __dispatch(self) -> None:
+        while self.__waiting:
+            now: float = monotonic()
+            if now < self.__paused_until:
+                await asyncio.sleep(self.__paused_until - now)
+                continue
+            self.__tokens = min(self.__burst, self.__tokens +
+                                (now - self.__updated) * self.__rate)
+            self.__updated = now
+            if self.__tokens < 1:
+                await asyncio.sleep((1 - self.__tokens) / self.__rate)
+                continue
+            priority, number, future = heapq.heappop(self.__waiting)
+            # cancelled requests don´t take a token
+            if not future.done():
+                self.__tokens -= 1
+                future.set_result(None)
+
+    # stops the whole bucket after the API told us to slow down
+    def __pause(self, seconds: float) -> None:
+        self.__paused_until = max(self.__paused_until, monotonic() + seconds)
+        self.__tokens = 0
+
+    def __delay(self, attempt: int) -> float:
+        return random.uniform(0, self.__backoff * 2 ** attempt)
+
+    # sends GET request to Brawl Stars API, returns status and decoded json (None if there is no json)
+    # with raw the body is returned as bytes, so the caller can decode only what it needs
+    async def get(self, path: str, priority: int = BACKGROUND, raw: bool = False) -> Tuple[int, dict]:
+        cached = self.__cache.get(path) if self.__cache is not None else None
+        if cached is not None:
+            self.cache_hits += 1
+            status, body = cached
+        else:
+            future = self.__in_flight.get(path)
+            if future is None:
+                # set before the request starts, so callers joining it right away can raise it already
+                self.__priorities[path] = priority
+                future = asyncio.ensure_future(self.__fetch(path))
+                self.__in_flight[path] = future
+                future.add_done_callback(lambda done: self.__done(path))
+            else:
+                self.coalesced += 1
+                self.__raise_priority(path, priority)
+            # one waiting caller being cancelled doesn´t cancel the request of the others
+            status, body = await asyncio.shield(future)
+        if raw or body is None:
+            return status, body
+        try:
+            return status, json.loads(body) if len(body.strip()) > 0 else None
+        except ValueError as error:
+            print(f"Response of {path} isn't json: {error}")
+            return 0, None
+
+    def __done(self, path: str) -> None:
+        self.__in_flight.pop(path, None)
+        self.__priorities.pop(path, None)
+
+    # sends the request until it gets an answer which isn´t 429 or a server error, returns status and body
+    async def __fetch(self, path: str) -> Tuple[int, bytes]:
+        status: int = 0
+        body: bytes = None
+        for attempt in range(self.__max_retries + 1):
+            if attempt > 0:
+                self.retried += 1
+            await self.__acquire(self.__priorities[path], path)
+            delay: float = self.__delay(attempt)
+            try:
+                async with self.__concurrency:
+                    self.requests += 1
+                    status = 0
+                    sent: float = monotonic()
+                    try:
+                        async with self.__session.get(self.__url + path) as response:
+                            status = response.status
+                            body = await response.read()
+                            if status == 429:
+                                self.throttled += 1
+                                retry_after: float = retry_after_seconds(
+                                    response.headers.get("Retry-After"))
+                                self.__pause(retry_after)
+                                delay = max(delay, retry_after)
+                            elif status < 500:
+                                max_age: float = max_age_seconds(
+                                    response.headers.get("Cache-Control"))
+                                if status == 200 and max_age > 0 and self.__cache is not None:
+                                    self.__cache.set(path, status, body, max_age)
+                                return status, body
+                    finally:
+                        if self.__latency is not None:
+                            self.__latency.observe(
+                                monotonic() - sent, endpoint_name(path), str(status))
+            except (aiohttp.ClientError, asyncio.TimeoutError) as error:
+                status, body = 0, None
+                print(f"Request {path} failed: {error}")
+            if attempt < self.__max_retries:
+                await asyncio.sleep(delay)
+        self.failed += 1
+        return status, body
+
+
+# responses of Brawl Stars API by path, each kept for max-age of its Cache-Control header
+# least recently used responses are removed first when there are too many of them or they are too big
+class ResponseCache:
+    def __init__(self, max_entries: int, max_bytes: int) -> None:
+        self.__max_entries = max_entries
+        self.__max_bytes = max_bytes
+        # path -> (status, body, time of expiration)
+        self.__responses: collections.OrderedDict = collections.OrderedDict()
+        self.__bytes: int = 0
+
+    def __len__(self) -> int:
+        return len(self.__responses)
+
+    # returns (status, body) or None if the response isn´t cached or is too old
+    def get(self, path: str):
+        if path not in self.__responses:
+            return None
+        status, body, expires = self.__responses[path]
+        if expires <= monotonic():
+            self.pop(path)
+            return None
+        self.__responses.move_to_end(path)
+        return status, body
+
+    def set(self, path: str, status: int, body: bytes, max_age: float) -> None:
+        self.pop(path)
+        if len(body) > self.__max_bytes:
+            return
+        self.__responses[path] = (status, body, monotonic() + max_age)
+        self.__bytes += len(body)
+        while len(self.__responses) > self.__max_entries or self.__bytes > self.__max_bytes:
+            self.pop(next(iter(self.__responses)))
+
+    def pop(self, path: str) -> None:
+        if path in self.__responses:
+            self.__bytes -= len(self.__responses.pop(path)[1])
+
+
+# endpoint of a path without the player tag, so latencies of all players are counted together
+def endpoint_name(path: str) -> str:
+    parts: List[str] = path.strip("/").split("/")
+    # /players/%23TAG/battlelog -> battlelog, /players/%23TAG -> players
+    return parts[2] if len(parts) >= 3 else parts[0]
+
+
+# value of Retry-After header in seconds, API sends just number of seconds
+def retry_after_seconds(value: str) -> float:
+    try:
+        return max(float(value), 0)
+    except (TypeError, ValueError):
+        return 0
+
+
+# max-age of Cache-Control header in seconds, 0 when the response mustn´t be cached
+def max_age_seconds(value: str) -> float:
+    if value is None:
+        return 0
+    max_age: float = 0
+    for directive in value.lower().split(","):
+        name, _, argument = directive.strip().partition("=")
+        if name in ("no-store", "no-cache"):
+            return 0
+        if name == "max-age":
+            try:
+                max_age = max(float(argument.strip('"')), 0)
+            except ValueError:
+                return 0
+    return max_age
+
+
+# player tags are saved without # and in upper case
+def normalize_tag(tag: str) -> str:
+    return tag.strip().lstrip("#").upper()
+
+
+# cache of in-game names of players by their tags, also remembers tags which don´t exist
+class PlayerNameCache:
+    def __init__(self, ttl: float, invalid_ttl: float) -> None:
+        self.__ttl = ttl
+        self.__invalid_ttl = invalid_ttl
+        # tag -> (name or None for invalid tag, time of expiration)
+        self.__names: dict = {}
+
+    # returns if the tag is cached and its name, name is None for invalid tags
+    def get(self, tag: str) -> Tuple[bool, str]:
+        tag = normalize_tag(tag)
+        if tag in self.__names:
+            name, expires = self.__names[tag]
+            if monotonic() < expires:
+                return True, name
+            del self.__names[tag]
+        return False, None
+
+    def set(self, tag: str, name: str) -> None:
+        self.__names[normalize_tag(tag)] = (name, monotonic() + self.__ttl)
+
+    def set_invalid(self, tag: str) -> None:
+        self.__names[normalize_tag(tag)] = (
+            None, monotonic() + self.__invalid_ttl)
+
+    def is_invalid(self, tag: str) -> bool:
+        found, name = self.get(tag)
+        return found and name is None
+
@@ -0,0 +1,140 @@
+from time import perf_counter
+from typing import Dict, List, Tuple
+import asyncio
+import bisect
+from aiohttp import web
+
+# metrics of the running bot, shown in Prometheus text format on a local http endpoint and by d!perf
+
+# buckets (upper bounds in seconds) of durations
+LATENCY_BUCKETS: tuple = (0.005, 0.01, 0.025, 0.05, 0.1,
+                          0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+
+def format_labels(names: tuple, values: tuple, extra: str = "") -> str:
+    labels: List[str] = [f'{name}="{value}"' for name, value in zip(names, values)]
+    if extra != "":
+        labels.append(extra)
+    return "{" + ",".join(labels) + "}" if len(labels) > 0 else ""
+
+
+# number which only grows (requests, finished matches)
+class Counter:
+    def __init__(self, name: str, description: str, labels: tuple = ()) -> None:
+        self.name = name
+        self.description = description
+        self.labels = labels
+        self.values: Dict[tuple, float] = {}
+
+    def inc(self, *labels, amount: float = 1) -> None:
+        self.values[labels] = self.values.get(labels, 0) + amount
+
+    def total(self) -> float:
+        return sum(self.values.values())
+
+    def expose(self) -> List[str]:
+        lines: List[str] = [f"# HELP {self.name} {self.description}",
+                            f"# TYPE {self.name} counter"]
+        for labels, value in sorted(self.values.items()):
+            lines.append(
+                f"{self.name}{format_labels(self.labels, labels)} {value}")
+        return lines
+
+
+# number read when metrics are shown (sizes of dictionaries, queue depth), value is a function without arguments
+class Gauge:
+    def __init__(self, name: str, description: str, value) -> None:
+        self.name = name
+        self.description = description
+        self.value = value
+
+    def expose(self) -> List[str]:
+        return [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} gauge", f"{self.name} {self.value()}"]
+
+
+# durations counted into buckets, quantiles are estimated as the upper bound of their bucket
+class Histogram:
+    def __init__(self, name: str, description: str, labels: tuple = (), buckets: tuple = LATENCY_BUCKETS) -> None:
+        self.name = name
+        self.description = description
+        self.labels = labels
+        self.buckets = buckets
+        # labels -> [counts of buckets (the last one is +Inf), sum, count, last value]
+        self.values: Dict[tuple, list] = {}
+
+    def observe(self, value: float, *labels) -> None:
+        if labels not in self.values:
+            self.values[labels] = [[0] * (len(self.buckets) + 1), 0, 0, 0]
+        histogram: list = self.values[labels]
+        histogram[0][bisect.bisect_left(self.buckets, value)] += 1
+        histogram[1] += value
+        histogram[2] += 1
+        histogram[3] = value
+
+    # returns (count, average, estimated quantile, last value) of one set of labels
+    def summary(self, labels: tuple = (), quantile: float = 0.95) -> Tuple[int, float, float, float]:
+        if labels not in self.values:
+            return 0, 0, 0, 0
+        counts, total, count, last = self.values[labels]
+        seen: int = 0
+        for i, bucket_count in enumerate(counts):
+            seen += bucket_count
+            if seen >= quantile * count:
+                break
+        upper: float = self.buckets[i] if i < len(
+            self.buckets) else float("inf")
+        return count, total / count, upper, last
+
+    def expose(self) -> List[str]:
+        lines: List[str] = [f"# HELP {self.name} {self.description}",
+                            f"# TYPE {self.name} histogram"]
+        for labels, (counts, total, count, last) in sorted(self.values.items()):
+            cumulative: int = 0
+            for bucket, bucket_count in zip(self.buckets + ("+Inf",), counts):
+                cumulative += bucket_count
+                bucket_label: str = 'le="' + str(bucket) + '"'
+                lines.append(
+                    f"{self.name}_bucket{format_labels(self.labels, labels, bucket_label)} {cumulative}")
+            lines.append(
+                f"{self.name}_sum{format_labels(self.labels, labels)} {total}")
+            lines.append(
+                f"{self.name}_count{format_labels(self.labels, labels)} {count}")
+        return lines
+
+
+# all metrics of the bot in the order they are shown
+class Registry:
+    def __init__(self) -> None:
+        self.metrics: List = []
+
+    def add(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def expose(self) -> str:
+        lines: List[str] = []
+        for metric in self.metrics:
+            lines.extend(metric.expose())
+        return "\n".join(lines) + "\n"
+
+
+# measures how late the event loop wakes up from sleeping, long callbacks (json, embeds) make it late
+async def watch_loop_lag(histogram: Histogram, interval: float = 1) -> None:
+    while True:
+        start: float = perf_counter()
+        await asyncio.sleep(interval)
+        histogram.observe(max(0, perf_counter() - start - interval))
+
+
+# local http endpoint with metrics in Prometheus text format, returns runner to stop it
+async def start_metrics_server(registry: Registry, host: str, port: int) -> web.AppRunner:
+    async def handle(request):
+        return web.Response(text=registry.expose(), content_type="text/plain", charset="utf-8",
+                            headers={"Cache-Control": "no-store"})
+
+    app = web.Application()
+    app.router.add_get("/metrics", handle)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    return runner
@@ -0,0 +1,91 @@
+from typing import Dict, List
+import asyncio
+import collections
+import random
+
+import aiohttp
+from discord import Embed, HTTPException
+
+# Discord allows at most 10 embeds and 6000 characters of all embeds in one message
+MAX_EMBEDS: int = 10
+MAX_EMBED_CHARS: int = 6000
+
+
+# embeds waiting to be sent, every channel has its own queue and sender
+# embeds of one channel are joined into messages of up to 10 embeds, so the scan doesn´t wait for Discord
+class Outbox:
+    def __init__(self, delay: float, interval: float, max_retries: int = 3, backoff: float = 1.0) -> None:
+        # how long to collect embeds before the first message and how long to wait between messages of one channel
+        self.__delay = delay
+        self.__interval = interval
+        self.__max_retries = max_retries
+        self.__backoff = backoff
+        # channel id -> embeds waiting to be sent
+        self.__queues: Dict[int, collections.deque] = {}
+        self.__channels: Dict[int, object] = {}
+        self.__senders: Dict[int, asyncio.Task] = {}
+        self.messages: int = 0
+        self.embeds: int = 0
+        self.failed: int = 0
+
+    # number of embeds waiting to be sent
+    def __len__(self) -> int:
+        return sum(len(queue) for queue in self.__queues.values())
+
+    def post(self, channel, embed: Embed) -> None:
+        if channel.id not in self.__queues:
+            self.__queues[channel.id] = collections.deque()
+        self.__queues[channel.id].append(embed)
+        self.__channels[channel.id] = channel
+        if channel.id not in self.__senders:
+            self.__senders[channel.id] = asyncio.create_task(
+                self.__send_all(channel.id))
+
+    # takes embeds for one message from the start of the queue
+    def __next_message(self, queue: collections.deque) -> List[Embed]:
+        embeds: List[Embed] = [queue.popleft()]
+        chars: int = len(embeds[0])
+        while len(queue) > 0 and len(embeds) < MAX_EMBEDS and chars + len(queue[0]) <= MAX_EMBED_CHARS:
+            chars += len(queue[0])
+            embeds.append(queue.popleft())
+        return embeds
+
+    async def __send_all(self, channel_id: int) -> None:
+        try:
+            # matches finished in the same scan come together
+            await asyncio.sleep(self.__delay)
+            queue: collections.deque = self.__queues[channel_id]
+            while len(queue) > 0:
+                await self.__send(self.__channels[channel_id], self.__next_message(queue))
+                if len(queue) > 0:
+                    await asyncio.sleep(self.__interval)
+        finally:
+            self.__senders.pop(channel_id, None)
+            self.__queues.pop(channel_id, None)
+            self.__channels.pop(channel_id, None)
+
+    # discord.py waits for rate limits itself, server and connection errors are tried again and other errors drop the message
+    async def __send(self, channel, embeds: List[Embed]) -> None:
+        for attempt in range(self.__max_retries + 1):
+            try:
+                await channel.send(embeds=embeds)
+                self.messages += 1
+                self.embeds += len(embeds)
+                return
+            except HTTPException as error:
+                if error.status < 500 and error.status != 429:
+                    print(f"Sending to {channel.id} failed: {error}")
+                    break
+            except (aiohttp.ClientError, asyncio.TimeoutError, OSError) as error:
+                print(f"Sending to {channel.id} failed: {error!r}")
+            except Exception as error:
+                print(f"Sending to {channel.id} failed: {error!r}")
+                break
+            if attempt < self.__max_retries:
+                await asyncio.sleep(random.uniform(0, self.__backoff * 2 ** attempt))
+        self.failed += len(embeds)
+
+    # waits until everything posted so far is sent
+    async def drain(self) -> None:
+        while len(self.__senders) > 0:
+            await asyncio.gather(*self.__senders.values(), return_exceptions=True)
@@ -0,0 +1,50 @@
+from typing import Dict, List, Set
+import math
+import random
+
+
+# time wheel of player polls, one slot is checked every tick
+# every player is in exactly one slot, so polls are spread evenly instead of coming in one burst
+class PollWheel:
+    def __init__(self, tick: float, longest_interval: float) -> None:
+        self.tick = tick
+        self.__slots: List[Set[str]] = [set()
+                                        for _ in range(math.ceil(longest_interval / tick) + 1)]
+        self.__slot_of: Dict[str, int] = {}
+        self.__current: int = 0
+
+    def __len__(self) -> int:
+        return len(self.__slot_of)
+
+    def __contains__(self, tag: str) -> bool:
+        return tag in self.__slot_of
+
+    def tags(self) -> List[str]:
+        return list(self.__slot_of)
+
+    # plans the next poll of a player after delay seconds, jitter is a part of the delay chosen randomly (0.1 = +-10 %)
+    def schedule(self, tag: str, delay: float, jitter: float = 0) -> None:
+        self.remove(tag)
+        delay = delay * (1 + random.uniform(-jitter, jitter))
+        ticks: int = min(max(1, round(delay / self.tick)),
+                         len(self.__slots) - 1)
+        slot: int = (self.__current + ticks) % len(self.__slots)
+        self.__slots[slot].add(tag)
+        self.__slot_of[tag] = slot
+
+    # plans the first poll of a new player somewhere in the interval, so new players don´t come at once
+    def schedule_new(self, tag: str, interval: float) -> None:
+        self.schedule(tag, random.uniform(0, interval))
+
+    def remove(self, tag: str) -> None:
+        if tag in self.__slot_of:
+            self.__slots[self.__slot_of.pop(tag)].discard(tag)
+
+    # moves to the next slot and returns players which should be polled now
+    def advance(self) -> Set[str]:
+        self.__current = (self.__current + 1) % len(self.__slots)
+        due: Set[str] = self.__slots[self.__current]
+        self.__slots[self.__current] = set()
+        for tag in due:
+            self.__slot_of.pop(tag, None)
+        return due
@@ -0,0 +1,216 @@
+from time import perf_counter
+from typing import Dict, List, Tuple
+import asyncio
+import cProfile
+import io
+import pstats
+import sys
+import threading
+import time
+import tracemalloc
+
+# profiling of the running bot on demand (d!profile), reports are plain text sent as a file
+
+# how many functions and allocation sites are in a report
+REPORT_LINES: int = 30
+
+
+# cProfile and tracemalloc between start() and stop(), everything running on the event loop meanwhile is counted
+# only one capture can run at a time, profilers and tracemalloc of two captures would stop each other
+class ProfileCapture:
+    running = None
+
+    def __init__(self, frames: int = 10) -> None:
+        self.__frames = frames
+        self.__profiler = cProfile.Profile()
+        self.__snapshot: tracemalloc.Snapshot = None
+        self.__started_tracing: bool = False
+        self.__start: float = 0
+
+    # raises RuntimeError when another capture is running
+    def start(self) -> None:
+        if ProfileCapture.running is not None:
+            raise RuntimeError("another capture is running")
+        ProfileCapture.running = self
+        # tracemalloc may be running already (bench.py), then it is left running
+        self.__started_tracing = not tracemalloc.is_tracing()
+        try:
+            if self.__started_tracing:
+                tracemalloc.start(self.__frames)
+            tracemalloc.reset_peak()
+            self.__snapshot = tracemalloc.take_snapshot()
+            self.__start = perf_counter()
+            self.__profiler.enable()
+        except BaseException:
+            # a capture which didn´t start mustn´t block the next ones
+            if self.__started_tracing:
+                tracemalloc.stop()
+            ProfileCapture.running = None
+            raise
+
+    # returns the report, functions by cumulative time and allocation sites by memory allocated since start()
+    def stop(self, title: str) -> str:
+        try:
+            self.__profiler.disable()
+            wall: float = perf_counter() - self.__start
+            snapshot: tracemalloc.Snapshot = tracemalloc.take_snapshot()
+            current, peak = tracemalloc.get_traced_memory()
+        finally:
+            if self.__started_tracing:
+                tracemalloc.stop()
+            ProfileCapture.running = None
+        report = io.StringIO()
+        report.write(f"{title}\nwall {wall:.3f} s, traced memory {current / 2 ** 20:.1f} MiB, "
+                     f"peak {peak / 2 ** 20:.1f} MiB\n\n")
+        report.write(f"Top {REPORT_LINES} functions by cumulative time\n")
+        stats = pstats.Stats(self.__profiler, stream=report)
+        stats.sort_stats(pstats.SortKey.CUMULATIVE).print_stats(REPORT_LINES)
+        report.write(f"Top {REPORT_LINES} allocation sites by memory allocated during profiling\n")
+        for statistic in snapshot.compare_to(self.__snapshot, "lineno")[:REPORT_LINES]:
+            report.write(f"{statistic.size_diff / 1024:>10.1f} KiB {statistic.count_diff:>8} blocks  "
+                         f"{statistic.traceback}\n")
+        return report.getvalue()
+
+
+# profiles the next cycles of a loop, the loop calls begin() and end() around every cycle
+class CycleProfiler:
+    def __init__(self) -> None:
+        self.__capture: ProfileCapture = None
+        self.__running: bool = False
+        self.__cycles: int = 0
+        self.__profiled: int = 0
+        self.__report: asyncio.Future = None
+
+    # cycles are being profiled or wait to be profiled
+    @property
+    def busy(self) -> bool:
+        return self.__report is not None
+
+    # returns future with the report of the next cycles, None if cycles are being profiled or another capture runs
+    def request(self, cycles: int) -> asyncio.Future:
+        if self.__report is not None or ProfileCapture.running is not None:
+            return None
+        self.__capture = ProfileCapture()
+        self.__cycles = cycles
+        self.__profiled = 0
+        self.__report = asyncio.get_running_loop().create_future()
+        return self.__report
+
+    # a cycle starting while another capture runs isn´t profiled, profiling starts with a later cycle
+    # a capture which can´t start ends the request, the error goes to whoever waits for the report
+    def begin(self) -> None:
+        if self.__report is not None and not self.__running and ProfileCapture.running is None:
+            try:
+                self.__capture.start()
+            except Exception as error:
+                report_future: asyncio.Future = self.__report
+                self.__report = None
+                self.__capture = None
+                if not report_future.done():
+                    report_future.set_exception(error)
+                return
+            self.__running = True
+
+    # gives up the request, a capture which is running is stopped without a report
+    def cancel(self) -> None:
+        report_future: asyncio.Future = self.__report
+        capture: ProfileCapture = self.__capture
+        running: bool = self.__running
+        self.__running = False
+        self.__report = None
+        self.__capture = None
+        if report_future is not None and not report_future.done():
+            report_future.cancel()
+        if running:
+            try:
+                capture.stop("cancelled")
+            except Exception as error:
+                print(f"Stopping the cancelled profiling failed: {error!r}")
+
+    # errors of the capture go to whoever waits for the report, not to the loop
+    def end(self) -> None:
+        if not self.__running:
+            return
+        self.__profiled += 1
+        if self.__profiled < self.__cycles:
+            return
+        report_future: asyncio.Future = self.__report
+        self.__running = False
+        self.__report = None
+        try:
+            report: str = self.__capture.stop(f"{self.__profiled} scan cycles")
+            if not report_future.done():
+                report_future.set_result(report)
+        except Exception as error:
+            if not report_future.done():
+                report_future.set_exception(error)
+        finally:
+            self.__capture = None
+
+
+# counts stacks of one thread sampled every interval seconds by another thread, cheap enough to run all the time
+# functions are counted by samples where they run themselves (own) and where they are anywhere on the stack (total)
+class StackSampler:
+    def __init__(self, interval: float) -> None:
+        self.__interval = interval
+        self.__thread_id: int = None
+        self.__thread: threading.Thread = None
+        self.__stopped = threading.Event()
+        self.__lock = threading.Lock()
+        # (file, first line, function) -> [own samples, total samples]
+        self.__counts: Dict[Tuple[str, int, str], List[int]] = {}
+        self.__samples: int = 0
+        self.__since: float = time.time()
+
+    # samples the thread which calls start()
+    def start(self) -> None:
+        self.__thread_id = threading.get_ident()
+        self.__stopped.clear()
+        self.__thread = threading.Thread(
+            target=self.__run, name="stack-sampler", daemon=True)
+        self.__thread.start()
+
+    def stop(self) -> None:
+        self.__stopped.set()
+
+    def __run(self) -> None:
+        while not self.__stopped.wait(self.__interval):
+            frame = sys._current_frames().get(self.__thread_id)
+            if frame is None:
+                continue
+            seen: set = set()
+            own: bool = True
+            with self.__lock:
+                self.__samples += 1
+                while frame is not None:
+                    code = frame.f_code
+                    key: tuple = (code.co_filename, code.co_firstlineno, code.co_name)
+                    if key not in self.__counts:
+                        self.__counts[key] = [0, 0]
+                    if own:
+                        self.__counts[key][0] += 1
+                        own = False
+                    if key not in seen:
+                        self.__counts[key][1] += 1
+                        seen.add(key)
+                    frame = frame.f_back
+
+    # returns the report and starts counting again
+    def report(self) -> str:
+        with self.__lock:
+            counts = self.__counts
+            samples: int = self.__samples
+            self.__counts = {}
+            self.__samples = 0
+        since: float = self.__since
+        self.__since = time.time()
+        report = io.StringIO()
+        report.write(f"{samples} samples every {self.__interval} s in {time.time() - since:.0f} s\n")
+        report.write("time in selector.select is the event loop waiting for something to do\n\n")
+        for title, column in (("own", 0), ("total", 1)):
+            report.write(f"Top {REPORT_LINES} functions by {title} samples\n")
+            for (filename, line, name), count in sorted(counts.items(), key=lambda item: item[1][column], reverse=True)[:REPORT_LINES]:
+                report.write(f"{count[column]:>8} {100 * count[column] / max(samples, 1):>5.1f} %  "
+                             f"{name} ({filename}:{line})\n")
+            report.write("\n")
+        return report.getvalue()
@@ -0,0 +1,142 @@
+from typing import Dict, List, Tuple
+import argparse
+import asyncio
+import collections
+import concurrent.futures
+import datetime
+import glob
+import multiprocessing
+import os
+
+from storage import GuildStore, MatchStore, merge_archives
+
+# counts statistics again from archived battle logs (BATTLE_LOG_ARCHIVE), without Discord
+# battle logs go through the same scanning_friendly_games(), send_battle() and PowerMatch as in the bot, so fixed detection
+# or newly added maps count also for older matches
+# servers are split between processes, every process replays all archives for its servers into a database in memory
+# and the matches replace matches of the servers in the time of the archives
+# the bot shouldn´t run while its database is rebuilt, run it in the directory of the bot:
+#   python replay.py archive/ --processes 4 --since 2023-03-01
+
+
+# room of a server for replay, finished matches are only counted
+class ReplayGuild:
+    def __init__(self, guild_id: int) -> None:
+        self.id = guild_id
+
+
+class ReplayChannel:
+    def __init__(self, guild_id: int, channel_id: int) -> None:
+        self.guild = ReplayGuild(guild_id)
+        self.id = channel_id
+
+    async def send(self, content: str = None, embed=None, embeds=None) -> None:
+        pass
+
+
+# matches found in the battle logs of players of the servers, returns ({server id: rows of matches}, first and last fetch)
+def replay_worker(paths: List[str], server_ids: List[str], since: float, until: float) -> Tuple[Dict[str, List[tuple]], float, float]:
+    os.environ["MATCHES_DB"] = ":memory:"
+    os.environ["OUTBOX_DELAY_SECONDS"] = "0"
+    os.environ["OUTBOX_INTERVAL_SECONDS"] = "0"
+    import bot as scrim_bot
+    return asyncio.run(replay(scrim_bot, paths, server_ids, since, until))
+
+
+async def replay(scrim_bot, paths: List[str], server_ids: List[str], since: float, until: float) -> Tuple[Dict[str, List[tuple]], float, float]:
+    # tag -> (server id, room, player) like get_subscribers() of the bot
+    subscribers: dict = collections.defaultdict(set)
+    for server_id in server_ids:
+        server_info: dict = scrim_bot.SERVERS[server_id]
+        channel = ReplayChannel(int(server_id), server_info["room"])
+        for player in server_info["players"]:
+            subscribers[scrim_bot.normalize_tag(player)].add(
+                (server_id, channel, player))
+    # watermarks and sent matches of the bot belong to the present
+    scrim_bot.WATERMARKS.clear()
+    scrim_bot.REPORTED_MATCHES.clear()
+    first: float = None
+    last: float = None
+    for fetched, tag, raw in merge_archives(paths):
+        if tag not in subscribers or fetched < since or fetched >= until:
+            continue
+        first = fetched if first == None else first
+        last = fetched
+        try:
+            name, battle_log = scrim_bot.decode_battle_log(tag, raw)
+        except ValueError as error:
+            print(f"Battle log of {tag} fetched at {fetched} couldn't be decoded: {error}")
+            continue
+        if name == None:
+            server_id, channel, player = next(iter(subscribers[tag]))
+            name = scrim_bot.SERVERS[server_id]["players"][player]
+        # the first battle log of a player is replayed whole
+        if tag not in scrim_bot.WATERMARKS:
+            scrim_bot.WATERMARKS[tag] = {"time": 0, "fingerprint": None}
+        await scrim_bot.scanning_friendly_games(tag, battle_log, name, subscribers[tag], fetched)
+    await scrim_bot.OUTBOX.drain()
+    matches: Dict[str, List[tuple]] = {server_id: [] for server_id in server_ids}
+    for row in scrim_bot.MATCHES.matches():
+        matches[row[0]].append(row)
+    return matches, first, last
+
+
+def parse_date(date: str) -> float:
+    return datetime.datetime.strptime(date, "%Y-%m-%d").replace(tzinfo=datetime.timezone.utc).timestamp()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="Counts statistics again from archived battle logs")
+    parser.add_argument("archives", nargs="+",
+                        help="archive files (.jsonl) or directories with them")
+    parser.add_argument("--processes", type=int, default=os.cpu_count())
+    parser.add_argument("--guild", action="append", default=[],
+                        help="replay only this server (can be used more times)")
+    parser.add_argument("--since", type=parse_date, default=0,
+                        help="replay battle logs fetched since the date (YYYY-MM-DD, UTC)")
+    parser.add_argument("--until", type=parse_date, default=float("inf"),
+                        help="replay battle logs fetched before the date (YYYY-MM-DD, UTC)")
+    parser.add_argument("--dry-run", action="store_true",
+                        help="only show how many matches were found")
+    args = parser.parse_args()
+
+    paths: List[str] = []
+    for archive in args.archives:
+        if os.path.isdir(archive):
+            paths.extend(sorted(glob.glob(os.path.join(archive, "*.jsonl"))))
+        else:
+            paths.append(archive)
+    servers = GuildStore(os.getenv("SERVERS_DIR", "servers"), 'servers.json', 0)
+    server_ids: List[str] = [server_id for server_id, server_info in servers.items()
+                             if "room" in server_info and "players" in server_info
+                             and (len(args.guild) == 0 or server_id in args.guild)]
+    processes: int = max(1, min(args.processes, len(server_ids)))
+    partitions: List[List[str]] = [server_ids[i::processes]
+                                   for i in range(processes)]
+
+    store: MatchStore = None if args.dry_run else MatchStore(
+        os.getenv("MATCHES_DB", "matches.db"))
+    # the bot is imported into every process once, so every process replays only one part of the servers
+    with concurrent.futures.ProcessPoolExecutor(processes, mp_context=multiprocessing.get_context("spawn"), max_tasks_per_child=1) as pool:
+        replays = [pool.submit(replay_worker, paths, partition, args.since, args.until)
+                   for partition in partitions if len(partition) > 0]
+        for replayed in concurrent.futures.as_completed(replays):
+            matches, first, last = replayed.result()
+            if first == None:
+                continue
+            # matches finished before the first archived battle log were counted by the bot already
+            since: float = max(args.since, first)
+            until: float = min(args.until, last + 1)
+            for server_id, rows in matches.items():
+                rows = [row for row in rows if since <= row[3] < until]
+                print(f"Server {server_id}: {len(rows)} matches between {datetime.datetime.fromtimestamp(since)} "
+                      f"and {datetime.datetime.fromtimestamp(until)}")
+                if store != None:
+                    store.replace_matches(server_id, since, until, rows)
+    if store != None:
+        store.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,481 @@
+from typing import Iterator, List, Tuple
+import asyncio
+import collections
+import datetime
+import heapq
+import json
+import os
+import shutil
+import sqlite3
+
+
+# loads json file, returns default if the file doesn´t exist yet
+def load_json(path: str, default: dict = None) -> dict:
+    try:
+        with open(path, 'r') as jsonfile:
+            return json.load(jsonfile)
+    except FileNotFoundError:
+        return default if default is not None else {}
+
+
+# writes the whole file into a temporary file first and then renames it, so the file is never half written
+def write_atomic(path: str, text: str) -> None:
+    temp_path: str = path + ".tmp"
+    with open(temp_path, 'w') as jsonfile:
+        jsonfile.write(text)
+        jsonfile.flush()
+        os.fsync(jsonfile.fileno())
+    os.replace(temp_path, path)
+
+
+# dictionary saved into a json file, changes only mark it dirty and it is written later by flush()
+class JsonStore:
+    def __init__(self, path: str, data: dict) -> None:
+        self.path = path
+        self.data = data
+        self.__dirty: bool = False
+        self.__lock = asyncio.Lock()
+
+    def mark_dirty(self) -> None:
+        self.__dirty = True
+
+    def is_dirty(self) -> bool:
+        return self.__dirty
+
+    # encodes the data on the event loop (so it can´t change while being encoded) and writes it in another thread
+    async def flush(self) -> None:
+        async with self.__lock:
+            if not self.__dirty:
+                return
+            self.__dirty = False
+            text: str = json.dumps(self.data, separators=(",", ":"))
+            try:
+                await asyncio.to_thread(write_atomic, self.path, text)
+            except OSError as error:
+                self.__dirty = True
+                print(f"Saving {self.path} failed: {error}")
+
+
+# fingerprints (64 bit numbers) of things which were already done, each remembered for ttl seconds
+# at most max_entries of them are kept, the oldest are forgotten first, saved into a json file by flush()
+class FingerprintStore:
+    def __init__(self, path: str, ttl: float, max_entries: int) -> None:
+        self.path = path
+        self.__ttl = ttl
+        self.__max_entries = max_entries
+        # fingerprint -> time of expiration, the oldest first
+        self.__expires: collections.OrderedDict = collections.OrderedDict()
+        self.__dirty: bool = False
+        self.__lock = asyncio.Lock()
+        now: float = datetime.datetime.now().timestamp()
+        for fingerprint, expires in sorted(load_json(path, {"fingerprints": []})["fingerprints"], key=lambda entry: entry[1]):
+            if expires > now:
+                self.__expires[fingerprint] = expires
+        self.__prune(now)
+
+    def __len__(self) -> int:
+        return len(self.__expires)
+
+    def __contains__(self, fingerprint: int) -> bool:
+        expires = self.__expires.get(fingerprint)
+        return expires != None and expires > datetime.datetime.now().timestamp()
+
+    def add(self, fingerprint: int) -> None:
+        now: float = datetime.datetime.now().timestamp()
+        self.__expires.pop(fingerprint, None)
+        self.__expires[fingerprint] = int(now + self.__ttl)
+        self.__prune(now)
+        self.__dirty = True
+
+    def clear(self) -> None:
+        self.__expires.clear()
+        self.__dirty = True
+
+    # all fingerprints have the same ttl, so expired ones are at the start
+    def __prune(self, now: float) -> None:
+        while len(self.__expires) > 0 and (len(self.__expires) > self.__max_entries or next(iter(self.__expires.values())) <= now):
+            self.__expires.popitem(last=False)
+
+    async def flush(self) -> None:
+        async with self.__lock:
+            if not self.__dirty:
+                return
+            self.__dirty = False
+            self.__prune(datetime.datetime.now().timestamp())
+            # only the copy is made on the event loop, the entries are encoded in the other thread
+            fingerprints: List[int] = list(self.__expires)
+            expires: List[int] = list(self.__expires.values())
+            try:
+                await asyncio.to_thread(write_fingerprints, self.path, fingerprints, expires)
+            except OSError as error:
+                self.__dirty = True
+                print(f"Saving {self.path} failed: {error}")
+
+
+# encodes the fingerprints in parts, the event loop can run between them, and writes them with write_atomic
+def write_fingerprints(path: str, fingerprints: List[int], expires: List[int], part: int = 10000) -> None:
+    parts: List[str] = [json.dumps(list(zip(fingerprints[start:start + part], expires[start:start + part])),
+                                   separators=(",", ":"))[1:-1] for start in range(0, len(fingerprints), part)]
+    write_atomic(path, '{"fingerprints":[' + ",".join(parts) + "]}")
+
+
+# json records of servers, one file per server in a directory, loaded on first use
+# at most max_loaded records are kept in memory, the least recently used are forgotten first (changed ones after being written)
+# flush() writes only records of servers which changed, records are moved once from the old file with all servers (legacy_path)
+class GuildStore:
+    def __init__(self, directory: str, legacy_path: str, max_loaded: int) -> None:
+        self.directory = directory
+        self.__max_loaded = max_loaded
+        # guild id -> record, the least recently used first
+        self.__records: collections.OrderedDict = collections.OrderedDict()
+        self.__dirty: set = set()
+        # records being written, they stay in memory until they are saved
+        self.__writing: set = set()
+        self.__deleted: set = set()
+        self.__lock = asyncio.Lock()
+        if not os.path.isdir(directory):
+            self.__migrate(legacy_path)
+        if os.path.exists(legacy_path):
+            os.replace(legacy_path, legacy_path + ".migrated")
+
+    # records are written into a temporary directory which gets its name only when all of them are there,
+    # so a migration which was interrupted starts again from the start
+    def __migrate(self, legacy_path: str) -> None:
+        temp_directory: str = self.directory + ".tmp"
+        shutil.rmtree(temp_directory, ignore_errors=True)
+        os.makedirs(temp_directory)
+        for guild, record in load_json(legacy_path).items():
+            write_atomic(os.path.join(temp_directory, f"{guild}.json"), json.dumps(
+                record, separators=(",", ":")))
+        os.replace(temp_directory, self.directory)
+
+    def __path(self, guild) -> str:
+        return os.path.join(self.directory, f"{guild}.json")
+
+    def __contains__(self, guild) -> bool:
+        guild = str(guild)
+        return guild in self.__records or (guild not in self.__deleted and os.path.exists(self.__path(guild)))
+
+    def __getitem__(self, guild) -> dict:
+        guild = str(guild)
+        if guild in self.__records:
+            self.__records.move_to_end(guild)
+            return self.__records[guild]
+        if guild in self.__deleted:
+            raise KeyError(guild)
+        try:
+            with open(self.__path(guild), 'r') as jsonfile:
+                record: dict = json.load(jsonfile)
+        except FileNotFoundError:
+            raise KeyError(guild)
+        self.__records[guild] = record
+        self.__evict()
+        return record
+
+    def __setitem__(self, guild, record: dict) -> None:
+        guild = str(guild)
+        self.__records[guild] = record
+        self.__records.move_to_end(guild)
+        self.__deleted.discard(guild)
+        self.mark_dirty(guild)
+        self.__evict()
+
+    def get(self, guild, default: dict = None) -> dict:
+        try:
+            return self[guild]
+        except KeyError:
+            return default
+
+    def pop(self, guild, default: dict = None) -> dict:
+        record: dict = self.get(guild, default)
+        guild = str(guild)
+        if guild in self:
+            self.__records.pop(guild, None)
+            self.__dirty.discard(guild)
+            self.__deleted.add(guild)
+        return record
+
+    # records changed in place have to be marked, so they are written
+    def mark_dirty(self, guild) -> None:
+        self.__dirty.add(str(guild))
+
+    def is_dirty(self) -> bool:
+        return len(self.__dirty) > 0 or len(self.__deleted) > 0
+
+    def keys(self) -> List[str]:
+        guilds: set = {name[:-len(".json")] for name in os.listdir(self.directory) if name.endswith(".json")}
+        return sorted((guilds | set(self.__records)) - self.__deleted)
+
+    # all records for reading, records which aren´t loaded are read without being kept in memory
+    def items(self) -> Iterator[Tuple[str, dict]]:
+        for guild in self.keys():
+            if guild in self.__records:
+                yield guild, self.__records[guild]
+                continue
+            yield guild, load_json(self.__path(guild))
+
+    def values(self) -> Iterator[dict]:
+        for guild, record in self.items():
+            yield record
+
+    # forgets the least recently used records which don´t wait to be written, the record used last is kept
+    def __evict(self) -> None:
+        for guild in list(self.__records)[:-1]:
+            if len(self.__records) <= self.__max_loaded:
+                break
+            if guild not in self.__dirty and guild not in self.__writing:
+                self.__records.pop(guild)
+
+    async def flush(self) -> None:
+        async with self.__lock:
+            if not self.is_dirty():
+                return
+            texts: dict = {guild: json.dumps(self.__records[guild], separators=(",", ":"))
+                           for guild in self.__dirty if guild in self.__records}
+            deleted: set = self.__deleted
+            self.__writing = set(texts)
+            self.__dirty = set()
+            self.__deleted = set()
+            try:
+                await asyncio.to_thread(self.__write, texts, deleted)
+            except OSError as error:
+                # records removed or added again meanwhile are already marked
+                self.__dirty.update(guild for guild in texts if guild in self.__records)
+                self.__deleted.update(guild for guild in deleted if guild not in self.__records)
+                print(f"Saving {self.directory} failed: {error}")
+            finally:
+                self.__writing = set()
+            self.__evict()
+
+    def __write(self, texts: dict, deleted: set) -> None:
+        for guild, text in texts.items():
+            write_atomic(self.__path(guild), text)
+        for guild in deleted:
+            try:
+                os.remove(self.__path(guild))
+            except FileNotFoundError:
+                pass
+
+
+# writes all dirty stores
+async def flush_all(stores: List) -> None:
+    for store in stores:
+        await store.flush()
+
+
+# every fetched battle log appended to a json lines file of the day, so statistics can be counted again later (replay.py)
+# one line is {"fetched": timestamp, "tag": player tag, "battlelog": battle log as sent by the API}
+class BattleLogArchive:
+    def __init__(self, directory: str, name: str = "battlelogs") -> None:
+        self.directory = directory
+        self.name = name
+        self.__lines: List[bytes] = []
+        self.__lock = asyncio.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def add(self, tag: str, fetched: float, raw: bytes) -> None:
+        raw = raw.strip()
+        # every battle log has to be on one line
+        if b"\n" in raw:
+            raw = json.dumps(json.loads(raw), separators=(",", ":")).encode()
+        self.__lines.append(b'{"fetched":%d,"tag":%s,"battlelog":%s}\n' % (
+            int(fetched), json.dumps(tag).encode(), raw))
+
+    def path(self) -> str:
+        day: str = datetime.datetime.now(datetime.timezone.utc).strftime("%Y%m%d")
+        return os.path.join(self.directory, f"{self.name}-{day}.jsonl")
+
+    async def flush(self) -> None:
+        async with self.__lock:
+            if len(self.__lines) == 0:
+                return
+            lines, self.__lines = self.__lines, []
+            try:
+                await asyncio.to_thread(append_lines, self.path(), lines)
+            except OSError as error:
+                self.__lines = lines + self.__lines
+                print(f"Archiving battle logs failed: {error}")
+
+
+def append_lines(path: str, lines: List[bytes]) -> None:
+    with open(path, 'ab') as archive:
+        archive.writelines(lines)
+
+
+# reads (fetched, tag, raw battle log) from an archive file, the battle log itself isn´t decoded
+def read_archive(path: str) -> Iterator[Tuple[int, str, bytes]]:
+    with open(path, 'rb') as archive:
+        for line in archive:
+            head, separator, body = line.rstrip().partition(b',"battlelog":')
+            if separator == b"" or not body.endswith(b"}"):
+                continue
+            info: dict = json.loads(head + b"}")
+            yield info["fetched"], info["tag"], body[:-1]
+
+
+# battle logs of all archive files ordered by the time they were fetched, every file is ordered already
+def merge_archives(paths: List[str]) -> Iterator[Tuple[int, str, bytes]]:
+    return heapq.merge(*(read_archive(path) for path in paths), key=lambda entry: entry[0])
+
+
+# every finished match is one row, statistics are counted from them for any time window
+# won is 1 when the team of brawler1-3 won the match
+MATCHES_SCHEMA: str = """
+CREATE TABLE IF NOT EXISTS matches (
+    id INTEGER PRIMARY KEY,
+    guild TEXT NOT NULL,
+    map TEXT NOT NULL,
+    mode TEXT NOT NULL,
+    time INTEGER NOT NULL,
+    brawler1 TEXT NOT NULL,
+    brawler2 TEXT NOT NULL,
+    brawler3 TEXT NOT NULL,
+    brawler4 TEXT NOT NULL,
+    brawler5 TEXT NOT NULL,
+    brawler6 TEXT NOT NULL,
+    won INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS matches_guild_mode_time ON matches (guild, mode, time);
+CREATE INDEX IF NOT EXISTS matches_guild_map_time ON matches (guild, map, time);
+CREATE INDEX IF NOT EXISTS matches_guild_time ON matches (guild, time);
+CREATE TABLE IF NOT EXISTS legacy_stats (
+    guild TEXT NOT NULL,
+    map TEXT NOT NULL,
+    mode TEXT NOT NULL,
+    brawler TEXT NOT NULL,
+    picks INTEGER NOT NULL,
+    victories INTEGER NOT NULL,
+    time INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS legacy_stats_guild_time ON legacy_stats (guild, time);
+CREATE TABLE IF NOT EXISTS stats_messages (
+    message_id INTEGER PRIMARY KEY,
+    guild TEXT NOT NULL,
+    mode TEXT NOT NULL,
+    days INTEGER,
+    since INTEGER NOT NULL,
+    until INTEGER NOT NULL,
+    count INTEGER NOT NULL
+);
+"""
+
+# picks and victories of every brawler on every map of a server, brawler4-6 won when the first team lost
+BRAWLER_STATS_QUERY: str = """
+SELECT map, brawler, SUM(picks), SUM(victories) FROM (
+    SELECT map, brawler1 AS brawler, 1 AS picks, won AS victories FROM matches WHERE guild = :guild AND time >= :since AND time < :until
+    UNION ALL SELECT map, brawler2, 1, won FROM matches WHERE guild = :guild AND time >= :since AND time < :until
+    UNION ALL SELECT map, brawler3, 1, won FROM matches WHERE guild = :guild AND time >= :since AND time < :until
+    UNION ALL SELECT map, brawler4, 1, 1 - won FROM matches WHERE guild = :guild AND time >= :since AND time < :until
+    UNION ALL SELECT map, brawler5, 1, 1 - won FROM matches WHERE guild = :guild AND time >= :since AND time < :until
+    UNION ALL SELECT map, brawler6, 1, 1 - won FROM matches WHERE guild = :guild AND time >= :since AND time < :until
+    UNION ALL SELECT map, brawler, picks, victories FROM legacy_stats WHERE guild = :guild AND time >= :since AND time < :until
+) GROUP BY map, brawler
+"""
+
+# the same for every time bucket (time // :bucket) between since and until
+BRAWLER_STATS_BY_BUCKET_QUERY: str = """
+SELECT bucket, map, brawler, SUM(picks), SUM(victories) FROM (
+    SELECT time / :bucket AS bucket, map, brawler1 AS brawler, 1 AS picks, won AS victories FROM matches WHERE guild = :guild AND time >= :since AND time < :until
+    UNION ALL SELECT time / :bucket, map, brawler2, 1, won FROM matches WHERE guild = :guild AND time >= :since AND time < :until
+    UNION ALL SELECT time / :bucket, map, brawler3, 1, won FROM matches WHERE guild = :guild AND time >= :since AND time < :until
+    UNION ALL SELECT time / :bucket, map, brawler4, 1, 1 - won FROM matches WHERE guild = :guild AND time >= :since AND time < :until
+    UNION ALL SELECT time / :bucket, map, brawler5, 1, 1 - won FROM matches WHERE guild = :guild AND time >= :since AND time < :until
+    UNION ALL SELECT time / :bucket, map, brawler6, 1, 1 - won FROM matches WHERE guild = :guild AND time >= :since AND time < :until
+    UNION ALL SELECT time / :bucket, map, brawler, picks, victories FROM legacy_stats WHERE guild = :guild AND time >= :since AND time < :until
+) GROUP BY bucket, map, brawler
+"""
+
+# versions of the database, saved in PRAGMA user_version
+SCHEMA_CREATED: int = 1
+LEGACY_STATS_IMPORTED: int = 2
+
+
+# SQLite database of finished matches, committed by flush() together with json files
+class MatchStore:
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self.__connection = sqlite3.connect(path, check_same_thread=False)
+        self.__connection.execute("PRAGMA journal_mode=WAL")
+        self.__connection.executescript(MATCHES_SCHEMA)
+        if self.version() < SCHEMA_CREATED:
+            self.set_version(SCHEMA_CREATED)
+        self.__dirty: bool = False
+        self.__lock = asyncio.Lock()
+
+    def version(self) -> int:
+        return self.__connection.execute("PRAGMA user_version").fetchone()[0]
+
+    def set_version(self, version: int) -> None:
+        self.__connection.execute(f"PRAGMA user_version = {int(version)}")
+        self.__connection.commit()
+
+    def add_match(self, guild: str, bsmap: str, mode: str, time: int, brawlers: Tuple[str, ...], won: bool) -> None:
+        self.__connection.execute(
+            "INSERT INTO matches (guild, map, mode, time, brawler1, brawler2, brawler3, brawler4, brawler5, brawler6, won) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (guild, bsmap, mode, int(time), *brawlers, int(won)))
+        self.__dirty = True
+
+    # returns (guild, map, mode, time, brawler1-6, won) of every match
+    def matches(self) -> List[tuple]:
+        return self.__connection.execute(
+            "SELECT guild, map, mode, time, brawler1, brawler2, brawler3, brawler4, brawler5, brawler6, won FROM matches ORDER BY time").fetchall()
+
+    # replaces matches of a server between since and until with rows from matches()
+    def replace_matches(self, guild: str, since: float, until: float, rows: List[tuple]) -> None:
+        self.__connection.execute(
+            "DELETE FROM matches WHERE guild = ? AND time >= ? AND time < ?", (guild, int(since), int(until)))
+        self.__connection.executemany(
+            "INSERT INTO matches (guild, map, mode, time, brawler1, brawler2, brawler3, brawler4, brawler5, brawler6, won) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", rows)
+        self.__connection.commit()
+
+    # returns (map, brawler, picks, victories) of every brawler on every map for matches between since and until
+    def brawler_stats(self, guild: str, since: float, until: float) -> List[Tuple[str, str, int, int]]:
+        return self.__connection.execute(BRAWLER_STATS_QUERY, {
+            "guild": guild, "since": int(since), "until": int(until)}).fetchall()
+
+    # returns (bucket, map, brawler, picks, victories), bucket is time // bucket_seconds
+    def brawler_stats_by_bucket(self, guild: str, since: float, until: float, bucket_seconds: int) -> List[Tuple[int, str, str, int, int]]:
+        return self.__connection.execute(BRAWLER_STATS_BY_BUCKET_QUERY, {
+            "guild": guild, "since": int(since), "until": int(until), "bucket": int(bucket_seconds)}).fetchall()
+
+    # remembers what a statistics message shows, so its embeds can be created again after a restart
+    def save_stats_message(self, message_id: int, guild: str, mode: str, days: int, since: float, until: float, count: int) -> None:
+        self.__connection.execute(
+            "INSERT OR REPLACE INTO stats_messages (message_id, guild, mode, days, since, until, count) VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (message_id, guild, mode, days, int(since), int(until), count))
+        self.__dirty = True
+
+    # returns (guild, mode, days, since, until, count) of a statistics message or None
+    def stats_message(self, message_id: int) -> tuple:
+        return self.__connection.execute(
+            "SELECT guild, mode, days, since, until, count FROM stats_messages WHERE message_id = ?", (message_id,)).fetchone()
+
+    def delete_stats_messages(self, older_than: float) -> None:
+        self.__connection.execute(
+            "DELETE FROM stats_messages WHERE until < ?", (int(older_than),))
+        self.__dirty = True
+
+    # imports counters of the old stats.json ({guild: {map: {brawler: {"PICKS", "VICTORIES"}}}}), they count as played at time
+    def import_legacy_stats(self, stats: dict, map_mode, time: int) -> None:
+        rows: List = []
+        for guild, maps in stats.items():
+            for bsmap, brawlers in maps.items():
+                if type(brawlers) == dict:
+                    for brawler, brawler_info in brawlers.items():
+                        rows.append((guild, bsmap, map_mode(bsmap), brawler, int(brawler_info.get("PICKS", 0)),
+                                     int(brawler_info.get("VICTORIES", 0)), int(time)))
+        self.__connection.executemany(
+            "INSERT INTO legacy_stats (guild, map, mode, brawler, picks, victories, time) VALUES (?, ?, ?, ?, ?, ?, ?)", rows)
+        self.__connection.commit()
+        self.set_version(LEGACY_STATS_IMPORTED)
+
+    async def flush(self) -> None:
+        async with self.__lock:
+            if not self.__dirty:
+                return
+            self.__dirty = False
+            await asyncio.to_thread(self.__connection.commit)
+
+    def close(self) -> None:
+        self.__connection.commit()
+        self.__connection.close()
@@ -0,0 +1,164 @@
+from typing import Dict, List, Tuple
+import asyncio
+import multiprocessing
+import sys
+import threading
+import time
+import types
+
+from battles import Battle, decode_battle_log
+from bs_api import RequestScheduler
+from storage import BattleLogArchive
+
+# fetching and decoding of battle logs can run in separate processes, the bot then only gets normalized battles
+# tasks are player tags (None stops the worker), results are (tag, status, name, battles)
+
+
+# runs in the worker process, every worker has its own part of the quota of the API key
+# every worker archives battle logs into its own files when archive (directory) isn´t empty
+def worker_main(tasks, results, url: str, token: str, rate: float, burst: int, max_concurrent: int, archive: str, number: int) -> None:
+    asyncio.run(run_worker(tasks, results, RequestScheduler(
+        url, token, rate, burst, max_concurrent),
+        BattleLogArchive(archive, f"battlelogs-worker{number}") if archive != "" else None))
+
+
+async def run_worker(tasks, results, api: RequestScheduler, archive: BattleLogArchive = None) -> None:
+    await api.start()
+    loop = asyncio.get_running_loop()
+    running: set = set()
+    while True:
+        tag: str = await loop.run_in_executor(None, tasks.get)
+        if tag == None:
+            break
+        task = asyncio.create_task(
+            fetch_battle_log(api, tag, results, archive))
+        running.add(task)
+        task.add_done_callback(running.discard)
+    if len(running) > 0:
+        await asyncio.wait(running)
+    await api.close()
+
+
+# every tag gets a result, the bot waits for it
+async def fetch_battle_log(api: RequestScheduler, tag: str, results, archive: BattleLogArchive = None) -> None:
+    try:
+        status, data = await api.get(f"/players/%23{tag}/battlelog", raw=True)
+        if status == 200:
+            if archive != None:
+                archive.add(tag, time.time(), data)
+            try:
+                name, battles = decode_battle_log(tag, data)
+                results.put((tag, status, name, battles))
+            except ValueError as error:
+                print(f"Battle log of {tag} couldn't be decoded: {error}")
+                results.put((tag, 0, None, None))
+            # the bot gets the battle log first, then it is written
+            if archive != None:
+                await archive.flush()
+        else:
+            results.put((tag, status, None, None))
+    except Exception as error:
+        print(f"Battle log of {tag} couldn't be fetched: {error!r}")
+        results.put((tag, 0, None, None))
+
+
+# processes fetching battle logs for the bot, rate and burst (the part of the quota not used by the bot) are split between them
+# a battle log not fetched in timeout seconds fails, a worker which died is started again and everything waiting fails
+class FetcherPool:
+    def __init__(self, workers: int, url: str, token: str, rate: float, burst: int, max_concurrent: int, archive: str = "", timeout: float = 300) -> None:
+        self.__context = multiprocessing.get_context("spawn")
+        self.__tasks = self.__context.Queue()
+        self.__results = self.__context.Queue()
+        self.__timeout = timeout
+        self.__worker_args: List[tuple] = [(self.__tasks, self.__results, url, token, rate / workers,
+                                            max(1, burst // workers), max(1, max_concurrent // workers), archive, number)
+                                           for number in range(workers)]
+        self.__processes: List = [self.__process(args)
+                                  for args in self.__worker_args]
+        # tag -> futures of everybody waiting for the battle log of the player
+        self.__waiting: Dict[str, List[asyncio.Future]] = {}
+        self.__loop: asyncio.AbstractEventLoop = None
+        self.__reader: threading.Thread = None
+        self.__watcher: asyncio.Task = None
+        self.restarted: int = 0
+
+    def __process(self, args: tuple):
+        return self.__context.Process(target=worker_main, daemon=True, args=args)
+
+    def start(self) -> None:
+        self.__loop = asyncio.get_running_loop()
+        start_processes(self.__processes)
+        self.__reader = threading.Thread(target=self.__read, daemon=True)
+        self.__reader.start()
+        self.__watcher = asyncio.create_task(self.__watch())
+
+    # tags taken by a dead worker never get a result, so everybody waiting gets a failure and the worker starts again
+    async def __watch(self, interval: float = 5) -> None:
+        while True:
+            await asyncio.sleep(interval)
+            dead: List[int] = [i for i, process in enumerate(
+                self.__processes) if not process.is_alive()]
+            if len(dead) == 0:
+                continue
+            print(f"Fetch workers {dead} exited, starting them again")
+            for i in dead:
+                self.__processes[i] = self.__process(self.__worker_args[i])
+            start_processes([self.__processes[i] for i in dead])
+            self.restarted += len(dead)
+            waiting = self.__waiting
+            self.__waiting = {}
+            for tag in waiting:
+                self.__resolve((tag, 0, None, None), waiting)
+
+    # reads results in its own thread and hands them over to the event loop
+    def __read(self) -> None:
+        while True:
+            result = self.__results.get()
+            if result == None:
+                break
+            self.__loop.call_soon_threadsafe(self.__resolve, result)
+
+    def __resolve(self, result: tuple, waiting: Dict[str, List[asyncio.Future]] = None) -> None:
+        waiting = self.__waiting if waiting == None else waiting
+        for future in waiting.pop(result[0], []):
+            if not future.done():
+                future.set_result(result[1:])
+
+    # returns (status, name of the player or None, normalized battles or None), status is 0 when the worker didn´t answer
+    async def fetch(self, tag: str) -> Tuple[int, str, List[Battle]]:
+        future = self.__loop.create_future()
+        if tag not in self.__waiting:
+            self.__waiting[tag] = []
+            self.__tasks.put(tag)
+        self.__waiting[tag].append(future)
+        try:
+            return await asyncio.wait_for(future, self.__timeout)
+        except asyncio.TimeoutError:
+            print(f"Fetch worker didn't answer for {tag} in {self.__timeout} s")
+            return 0, None, None
+        finally:
+            if tag in self.__waiting and future in self.__waiting[tag]:
+                self.__waiting[tag].remove(future)
+                if len(self.__waiting[tag]) == 0:
+                    del self.__waiting[tag]
+
+    async def close(self) -> None:
+        if self.__watcher != None:
+            self.__watcher.cancel()
+        for process in self.__processes:
+            self.__tasks.put(None)
+        for process in self.__processes:
+            await asyncio.to_thread(process.join, 10)
+        self.__results.put(None)
+
+
+# spawn runs the main module again in every new process (as __mp_main__), for the bot it would load all its files
+# and build the bot, so the main module is hidden while the processes start, workers need only this module
+def start_processes(processes: List) -> None:
+    main = sys.modules["__main__"]
+    sys.modules["__main__"] = types.ModuleType("__main__")
+    try:
+        for process in processes:
+            process.start()
+    finally:
+        sys.modules["__main__"] = main